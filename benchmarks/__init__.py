@@ -0,0 +1 @@
+__doc__ = ''' Benchmarks for the moire package.  (not installed) '''
@@ -0,0 +1,5 @@
+import sys
+
+from .construction import main
+
+sys.exit(main())
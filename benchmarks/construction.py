@@ -0,0 +1,244 @@
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+__doc__ = '''
+Benchmarks for the moire.exact construction pipeline.
+
+Every case is a fixed set of parameters, and is broken into stages which
+ are timed separately (best of --repeat), so that it is clear which part
+ of the pipeline dominates at a given supercell volume.  MoirePattern
+ memoizes everything it computes, so stages that time a method of a
+ pattern call it on a fresh pattern each time (built outside the timer).
+ Peak memory of a whole case is measured with tracemalloc in a separate run.
+
+	python -m benchmarks                       # run everything
+	python -m benchmarks --only hex            # cases whose name contains 'hex'
+	python -m benchmarks --save baseline.json  # record a baseline
+	python -m benchmarks --compare baseline.json [--tolerance 2]
+	python -m benchmarks --compare             # against the committed baseline
+
+With --compare, the exit status is nonzero if any stage got slower than
+ the baseline by more than the tolerance factor.  Stages that still take
+ less than --min-time are never flagged, as they are mostly noise.  A
+ baseline records its --repeat, which is reused when comparing against it
+ unless --repeat is given.  Timings are only comparable on similar hardware,
+ so re-record the committed baseline (benchmarks/baseline.json) with --save
+ when moving to a different machine.
+'''
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_REPEAT = 3
+
+# The largest volume for which the reference brute force search of C is timed.
+BRUTEFORCE_MAX_VOLUME = 2000
+
+# (β, p, q) fed to prim_rotation_moire_pq; volumes are roughly 10, 10^3..10^4, 10^6.
+ROTATION_CASES = [
+	('square-small',  1, 2, 1),
+	('square-medium', 1, 34, 21),
+	('square-huge',   1, 987, 610),
+	('hex-small',     3, 2, 1),
+	('hex-medium',    3, 55, 34),
+	('hex-huge',      3, 610, 377),
+]
+
+def rotation_stages(β, p, q):
+	from moire.exact import MoirePattern, find_nicer_cell
+	from moire.exact import build
+	from moire.exact.build import rotation_diophantine_triple, prim_rotation_moire_abc
+
+	state = {}
+	def forget_parametrization():
+		from sympy.core.cache import clear_cache
+		build._rotation_parametrization.cache_clear()
+		clear_cache() # (sympy's own cache would otherwise make repeats cheap)
+	def triple():
+		state['abc'] = rotation_diophantine_triple(β, p=p, q=q)
+	def construct():
+		(a, b, c) = state['abc']
+		state['pattern'] = prim_rotation_moire_abc(β=β, a=a, b=b, c=c)
+	def fresh():
+		(a, b, c) = state['abc']
+		state['fresh'] = prim_rotation_moire_abc(β=β, a=a, b=b, c=c)
+	def c_matrix():
+		state['fresh'].c_matrix()
+	def from_abe():
+		pat = state['pattern']
+		MoirePattern.from_abe(pat.a_matrix(), pat.b_matrix(), pat.e_matrix())
+	def analytic_c():
+		MoirePattern._analytic_c(state['pattern'].e_matrix())
+	def bruteforce_c():
+		MoirePattern._bruteforce_c(state['pattern'].e_matrix())
+	def d_matrix_hnf():
+		state['fresh'].d_matrix_hnf()
+	def nicer_cell():
+		find_nicer_cell(state['pattern'].c_matrix())
+
+	stages = [
+		# (the parametrization is cached per β, so it is otherwise never timed)
+		('rotation_diophantine_triple (cold)', triple, forget_parametrization),
+		('rotation_diophantine_triple', triple),
+		('prim_rotation_moire_abc', construct),
+		('c_matrix', c_matrix, fresh),
+		('from_abe', from_abe),
+		('analytic_c', analytic_c),
+		('bruteforce_c', bruteforce_c),
+		('d_matrix_hnf', d_matrix_hnf, fresh),
+		('find_nicer_cell', nicer_cell),
+	]
+	# stages run in order, so the earlier ones can set up state for the later ones
+	triple(); construct()
+	if state['pattern'].relative_supercell_volume() > BRUTEFORCE_MAX_VOLUME:
+		stages = [stage for stage in stages if stage[0] != 'bruteforce_c']
+	return stages
+
+def family_chain_stages():
+	from moire.exact import HEX_INDEX
+	from moire.exact.build import prim_rotation_moire_abc
+	pattern = prim_rotation_moire_abc(β=3, a=11, b=4, c=13)
+	def chain():
+		pat = pattern
+		for _ in range(5):
+			pat = pat.visit_family(HEX_INDEX).swap_cells()
+			pat = pat.visit_family(HEX_INDEX.inv()).swap_cells()
+		pat.c_matrix()
+	return [('visit_family+swap_cells x10', chain)]
+
+def symbolic_subs_stages():
+	from moire.exact.build import prim_rotation_moire_abc
+	from moire.exact.enumerate import enumerate_rotation_moires
+	state = {}
+	values = [dict(a=r.a, b=r.b, c=r.c) for r in enumerate_rotation_moires(3, max_c=100)]
+	def build():
+		state['template'] = prim_rotation_moire_abc(β=3)
+	def subs():
+		for d in values:
+			state['template'].subs(d).c_matrix()
+	def compiled_subs():
+		template = prim_rotation_moire_abc(β=3).compile()
+		for d in values:
+			template.subs(d).c_matrix()
+	build()
+	return [
+		('symbolic construction', build),
+		('subs x{}'.format(len(values)), subs),
+		('compile+subs x{}'.format(len(values)), compiled_subs),
+	]
+
+def all_cases():
+	cases = [(name, (lambda args=args: rotation_stages(*args)))
+		for (name, *args) in ROTATION_CASES]
+	cases.append(('hex-family-chain', family_chain_stages))
+	cases.append(('hex-symbolic-subs', symbolic_subs_stages))
+	return cases
+
+# A stage is (name, func) or (name, func, setup);  setup is called
+#  before every call of func, and is not timed.
+def _unpack(stage):
+	(name, func, setup) = tuple(stage) + (None,) * (3 - len(stage))
+	return (name, func, setup or (lambda: None))
+
+def time_stage(func, repeat, setup):
+	best = float('inf')
+	for _ in range(repeat):
+		setup()
+		t = time.perf_counter()
+		func()
+		best = min(best, time.perf_counter() - t)
+	return best
+
+def peak_memory(make_stages):
+	tracemalloc.start()
+	try:
+		for (_, func, setup) in map(_unpack, make_stages()):
+			setup()
+			func()
+		return tracemalloc.get_traced_memory()[1]
+	finally:
+		tracemalloc.stop()
+
+def run_case(make_stages, repeat):
+	stages = map(_unpack, make_stages())
+	return {
+		'stages': {name: time_stage(func, repeat, setup) for (name, func, setup) in stages},
+		'peak_bytes': peak_memory(make_stages),
+	}
+
+def environment():
+	import sympy
+	return {
+		'python': platform.python_version(),
+		'sympy': sympy.__version__,
+		'machine': platform.machine(),
+	}
+
+def compare(results, baseline, tolerance, min_time):
+	''' Print ratios against a baseline and return the list of regressions. '''
+	regressions = []
+	for (case, result) in results.items():
+		old = baseline['cases'].get(case)
+		if old is None:
+			continue
+		for (stage, t) in result['stages'].items():
+			if stage not in old['stages']:
+				continue
+			ratio = t / old['stages'][stage]
+			flag = ''
+			if ratio > tolerance and t >= min_time:
+				regressions.append((case, stage, ratio))
+				flag = '  <-- REGRESSION'
+			print('{:<20} {:<36} {:6.2f}x{}'.format(case, stage, ratio, flag))
+	return regressions
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=None,
+		help='best of this many runs per stage (default: that of the --compare'
+		' baseline, else {})'.format(DEFAULT_REPEAT))
+	parser.add_argument('--only', default='', help='only run cases containing this substring')
+	parser.add_argument('--save', metavar='JSON', help='write the results as a baseline')
+	parser.add_argument('--compare', metavar='JSON', nargs='?', const=DEFAULT_BASELINE,
+		help='compare against a baseline (default: the committed benchmarks/baseline.json)')
+	parser.add_argument('--tolerance', type=float, default=2.0,
+		help='slowdown factor considered a regression (default: 2)')
+	parser.add_argument('--min-time', type=float, default=1.0, metavar='MS',
+		help='stages faster than this are never regressions (default: 1 ms)')
+	args = parser.parse_args()
+
+	baseline = None
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+	repeat = args.repeat or (baseline or {}).get('repeat') or DEFAULT_REPEAT
+
+	results = {}
+	for (name, make_stages) in all_cases():
+		if args.only not in name:
+			continue
+		result = results[name] = run_case(make_stages, repeat)
+		print('{}  (peak {:.1f} MiB)'.format(name, result['peak_bytes'] / 2**20))
+		for (stage, t) in result['stages'].items():
+			print('    {:<36} {:10.3f} ms'.format(stage, t * 1e3))
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump({'environment': environment(), 'repeat': repeat, 'cases': results},
+				f, indent=1, sort_keys=True)
+
+	if baseline is not None:
+		print()
+		print('compared to {} (recorded with {}, repeat {})'.format(
+			args.compare, baseline.get('environment'), baseline.get('repeat', 'unknown')))
+		if compare(results, baseline, args.tolerance, args.min_time * 1e-3):
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
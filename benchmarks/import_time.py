@@ -0,0 +1,65 @@
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+
+__doc__ = '''
+Import-time benchmark.
+
+Each case is timed in a fresh interpreter, and also checks which heavy
+ dependencies ended up in sys.modules.  Lightweight imports must not pull
+ in sympy; a nonzero exit status is returned if one does, or if a case is
+ slower than --max-seconds.
+
+	python -m benchmarks.import_time [--repeat N] [--max-seconds T]
+'''
+
+# (name, code to time, modules which must NOT be imported by it)
+CASES = [
+	('import moire.exact', 'import moire.exact', ['sympy', 'numpy']),
+	('numeric enumeration',
+		'from moire.exact import enumerate_rotation_moires as f; list(f(3, max_c=50))',
+		['sympy']),
+	('load patterns',
+		'from moire.exact import load_patterns',
+		['sympy']),
+	('symbolic constructors', 'import moire.exact.build', []),
+]
+
+TEMPLATE = '''
+import json, sys, time
+t = time.perf_counter()
+{code}
+t = time.perf_counter() - t
+print(json.dumps([t, [m for m in {forbidden!r} if m in sys.modules]]))
+'''
+
+def time_case(code, forbidden):
+	script = TEMPLATE.format(code=code, forbidden=forbidden)
+	out = subprocess.check_output([sys.executable, '-c', script])
+	return json.loads(out.decode())
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--max-seconds', type=float, default=None,
+		help='fail if a lightweight import takes longer than this')
+	args = parser.parse_args()
+
+	ok = True
+	for (name, code, forbidden) in CASES:
+		results = [time_case(code, forbidden) for _ in range(args.repeat)]
+		best = min(t for (t, _) in results)
+		leaked = sorted(set(m for (_, ms) in results for m in ms))
+		print('{:<24} {:8.1f} ms  {}'.format(name, best * 1e3,
+			'imported: ' + ', '.join(leaked) if leaked else ''))
+		if leaked:
+			ok = False
+		if forbidden and args.max_seconds is not None and best > args.max_seconds:
+			ok = False
+	return 0 if ok else 1
+
+if __name__ == '__main__':
+	sys.exit(main())
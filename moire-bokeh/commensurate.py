@@ -0,0 +1,79 @@
+import numpy as np
+
+from fractions import Fraction
+
+# The exact library is optional here; without it (e.g. if the moire
+#  package is not installed) the viewer simply draws no overlay.
+try:
+	from moire.exact import angle_table
+	from moire.exact.field import square_part
+	from moire.exact.hnf import lagrange_reduce
+except ImportError:
+	angle_table = None
+
+# Cells from ShapeSelect are recognized as rational multiples of
+#  prim_rotation_cell(β) if they are this close to one.
+FAMILY_MAX_DENOMINATOR = 24
+FAMILY_TOLERANCE = 1e-9
+
+# The scale is rounded to a rational with a small denominator.
+SCALE_MAX_DENOMINATOR = 24
+SCALE_TOLERANCE = 1e-4
+
+def available():
+	return angle_table is not None
+
+def rational_family(cell):
+	# For a cell of the form [[1,0],[x,y]], find the squarefree β and
+	#  rational Q such that  cell == Q [[1,0],[0,sqrt(β)]],  or None.
+	cell = np.array(cell, dtype=float)
+	if not np.allclose(cell[0], [1, 0], rtol=0, atol=FAMILY_TOLERANCE):
+		return None
+	(x, y) = cell[1]
+	fx = Fraction(x).limit_denominator(FAMILY_MAX_DENOMINATOR)
+	fy2 = Fraction(y * y).limit_denominator(FAMILY_MAX_DENOMINATOR**2)
+	if abs(fx - x) > FAMILY_TOLERANCE or abs(fy2 - y * y) > FAMILY_TOLERANCE or fy2 <= 0:
+		return None
+	# y*y == n/d == (s*s*β)/(d*d)
+	(s, β) = square_part(fy2.numerator * fy2.denominator)
+	q = ((Fraction(1), Fraction(0)), (fx, Fraction(s, fy2.denominator) * (1 if y > 0 else -1)))
+	return (β, q)
+
+def commensurate_supercell(cell1, cell2, rotation, scale, max_volume, tolerance):
+	# Look for a commensurate moire pattern near the one displayed.
+	#
+	# cell1 and cell2 are the untransformed cells of the two layers, and layer 2
+	#  is rotated by `rotation` (radians) and scaled by `scale`.
+	# Returns (record, c_matrix, supercell) where record is a RotationMoire from
+	#  the angle table, c_matrix is the exact HNF supercell matrix for cell1, and
+	#  supercell is the cartesian cell  C' A  as a float array, where C' is the
+	#  reduced (most compact) equivalent of C.  Returns None if no commensurate
+	#  rotation with volume <= max_volume is within `tolerance`.
+	if not available():
+		return None
+	family = rational_family(cell1)
+	if family is None or family != rational_family(cell2):
+		return None
+	(β, q) = family
+
+	fscale = Fraction(scale).limit_denominator(SCALE_MAX_DENOMINATOR)
+	if abs(fscale - scale) > SCALE_TOLERANCE * scale:
+		return None
+
+	record = angle_table(β, max_volume).nearest(rotation, tolerance)
+	if record is None:
+		return None
+	c_matrix = record.family_c_matrix(q, fscale)
+
+	# the HNF cell is needle-like; draw the most compact one.
+	# (the metric of  Q prim_rotation_cell(β)  is  Q diag(1, β) Q^T)
+	metric = [[sum(q[i][k] * q[j][k] * (1, β)[k] for k in range(2)) for j in range(2)] for i in range(2)]
+	reduced = lagrange_reduce(c_matrix, metric)
+	supercell = np.array(reduced, dtype=float).dot(cell1)
+	return (record, c_matrix, supercell)
+
+def supercell_outline(supercell, cart_center):
+	# Corners of the copy of the supercell that is nearest to cart_center.
+	origin = np.rint(np.dot(cart_center, np.linalg.inv(supercell))).dot(supercell)
+	corners = np.array([[0, 0], [1, 0], [1, 1], [0, 1]]).dot(supercell) + origin
+	return (corners[:,0], corners[:,1])
@@ -0,0 +1,53 @@
+import numpy as np
+
+# A continuous picture of two overlapping lattices, for when there are far
+#  too many lattice points to draw.
+#
+# Each lattice is represented by its density  1 + sum_G cos(G . (r - r0))
+#  over its shortest reciprocal lattice vectors G, and the image shows the
+#  product of the two densities.  Expanded, that product is a sum of plane
+#  waves with wavevectors G1, G2 and G1 +/- G2;  the G1 - G2 terms are the
+#  long-wavelength moire fringes.  Only the plane waves that the pixel grid
+#  can resolve are kept, so that zooming out shows the fringes rather than
+#  aliasing of the atomic lattices.
+
+def shortest_reciprocal_vectors(cell, slack=1.5):
+	# The reciprocal vectors G = 2 pi (h, k) cell^-T with |h|, |k| <= 1, that
+	#  are not much longer than the shortest.  (always in +/- pairs)
+	recip = 2 * np.pi * np.linalg.inv(np.array(cell, dtype=float)).T
+	hk = np.array([(h, k) for h in (-1, 0, 1) for k in (-1, 0, 1) if (h, k) != (0, 0)])
+	gs = hk.dot(recip)
+	lengths = np.linalg.norm(gs, axis=1)
+	return gs[lengths <= slack * lengths.min()]
+
+def plane_waves(cell1, origin1, cell2, origin2):
+	# (wavevectors, phases, amplitudes) of the product of the two densities.
+	(g1, g2) = (shortest_reciprocal_vectors(cell1), shortest_reciprocal_vectors(cell2))
+	(p1, p2) = (-g1.dot(origin1), -g2.dot(origin2))
+	k = [g1, g2]
+	phase = [p1, p2]
+	amp = [np.ones(len(g1)), np.ones(len(g2))]
+	for sign in (1, -1):
+		k.append((g1[:,None,:] + sign * g2[None,:,:]).reshape(-1, 2))
+		phase.append((p1[:,None] + sign * p2[None,:]).reshape(-1))
+		amp.append(np.full(len(g1) * len(g2), 0.5))
+	return (np.concatenate(k), np.concatenate(phase), np.concatenate(amp))
+
+def intensity_image(cell1, origin1, cell2, origin2, view, shape):
+	# The image (an array of the given (rows, cols) shape) covering
+	#  view = (xmin, xmax, ymin, ymax);  row 0 is at the bottom, as bokeh expects.
+	(xmin, xmax, ymin, ymax) = view
+	(rows, cols) = shape
+	x = xmin + (np.arange(cols) + 0.5) * (xmax - xmin) / cols
+	y = ymin + (np.arange(rows) + 0.5) * (ymax - ymin) / rows
+
+	(k, phase, amp) = plane_waves(cell1, origin1, cell2, origin2)
+	nyquist = np.pi * min(cols / (xmax - xmin), rows / (ymax - ymin))
+	keep = np.linalg.norm(k, axis=1) < nyquist
+	(k, phase, amp) = (k[keep], phase[keep], amp[keep])
+
+	# sum_t amp_t cos(kx_t x + ky_t y + phase_t), which separates into a
+	#  product of an (rows, T) and a (T, cols) matrix.
+	ex = np.exp(1j * np.outer(k[:,0], x)) # (T, cols)
+	ey = np.exp(1j * np.outer(y, k[:,1])) * (amp * np.exp(1j * phase)) # (rows, T)
+	return 1 + ey.dot(ex).real
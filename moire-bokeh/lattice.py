@@ -0,0 +1,106 @@
+import numpy as np
+
+from math import ceil, floor, sqrt
+
+# Index ranges of the lattice points that are actually visible.
+#
+# A set of lattice points is described by "rows": arrays (i, lo, hi) such
+#  that for each integer i[k], the points with lo[k] <= j <= hi[k] are
+#  included.  (lo[k] > hi[k] for an empty row)  The points themselves are
+#  (i + shift[0]) * cell[0] + (j + shift[1]) * cell[1].
+
+def visible_rows(cell, shift, view):
+	# The rows of all points inside view = (xmin, xmax, ymin, ymax).
+	cell = np.array(cell, dtype=float)
+	(xmin, xmax, ymin, ymax) = view
+	corners = np.array([[x, y] for x in (xmin, xmax) for y in (ymin, ymax)])
+	direct = corners.dot(np.linalg.inv(cell)) - shift
+	i = np.arange(floor(direct[:,0].min()), ceil(direct[:,0].max()) + 1)
+
+	# For each cartesian axis, solve  vmin <= base + j * step <= vmax  for j.
+	lo = np.full(len(i), -np.inf)
+	hi = np.full(len(i), np.inf)
+	for (axis, (vmin, vmax)) in enumerate([(xmin, xmax), (ymin, ymax)]):
+		base = (i + shift[0]) * cell[0, axis] + shift[1] * cell[1, axis]
+		step = cell[1, axis]
+		if step == 0:
+			inside = (vmin <= base) & (base <= vmax)
+			(lo, hi) = (np.where(inside, lo, np.inf), np.where(inside, hi, -np.inf))
+			continue
+		(t0, t1) = ((vmin - base) / step, (vmax - base) / step)
+		(t0, t1) = (np.minimum(t0, t1), np.maximum(t0, t1))
+		(lo, hi) = (np.maximum(lo, t0), np.minimum(hi, t1))
+
+	empty = ~(lo <= hi) # (also catches nan)
+	lo = np.ceil(np.where(empty, 0, lo)).astype(np.int64)
+	hi = np.floor(np.where(empty, -1, hi)).astype(np.int64)
+	return (i, lo, hi)
+
+def row_count(rows):
+	(_, lo, hi) = rows
+	return int(np.maximum(hi - lo + 1, 0).sum())
+
+def stride_for_budget(count, max_points):
+	# Smallest stride s such that keeping every s-th index along both
+	#  axes leaves at most max_points points.
+	if count <= max_points:
+		return 1
+	return int(ceil(sqrt(count / max_points)))
+
+def rows_to_points(rows, stride=1):
+	# The (i, j) index arrays of the points in rows, keeping only multiples of stride.
+	(i, lo, hi) = rows
+	keep = i % stride == 0
+	(i, lo, hi) = (i[keep], lo[keep], hi[keep])
+	lo = -(-lo // stride) * stride # round up to a multiple of stride
+	counts = np.maximum((hi - lo) // stride + 1, 0)
+	starts = np.repeat(np.cumsum(counts) - counts, counts)
+	j = np.repeat(lo, counts) + (np.arange(counts.sum()) - starts) * stride
+	return (np.repeat(i, counts), j)
+
+def rows_contain(outer, inner):
+	# Does every point of inner also appear in outer?
+	(oi, olo, ohi) = outer
+	(ii, ilo, ihi) = inner
+	nonempty = ilo <= ihi
+	(ii, ilo, ihi) = (ii[nonempty], ilo[nonempty], ihi[nonempty])
+	if not len(ii):
+		return True
+	k = ii - oi[0]
+	if k.min() < 0 or k.max() >= len(oi):
+		return False
+	return bool(((olo[k] <= ilo) & (ihi <= ohi[k])).all())
+
+def padded_view(view, padding):
+	# view, grown by a fraction of its size on each side
+	(xmin, xmax, ymin, ymax) = view
+	(dx, dy) = (padding * (xmax - xmin), padding * (ymax - ymin))
+	return (xmin - dx, xmax + dx, ymin - dy, ymax + dy)
+
+class IndexGrid:
+	# The lattice points one layer is currently showing.
+	#
+	# To avoid regenerating the points on every small change of the view or
+	#  the cell, the points are generated for a padded view, and kept for as
+	#  long as they still cover the visible rectangle at the same stride.
+	PADDING = 0.25
+
+	def __init__(self, max_points):
+		self.max_points = max_points
+		self.i = self.j = np.zeros(0, dtype=np.int64)
+		self._rows = None
+		self._stride = None
+
+	def update(self, cell, shift, view):
+		# Returns True if the points (self.i, self.j) were regenerated.
+		visible = visible_rows(cell, shift, view)
+		stride = stride_for_budget(row_count(visible), self.max_points)
+		if self._rows is not None and stride == self._stride and rows_contain(self._rows, visible):
+			# also regenerate after zooming in a lot, so we don't keep sending junk
+			if len(self.i) <= 4 * max(row_count(visible) / stride**2, self.max_points / 4):
+				return False
+
+		self._rows = visible_rows(cell, shift, padded_view(view, self.PADDING))
+		self._stride = stride
+		(self.i, self.j) = rows_to_points(self._rows, stride)
+		return True
@@ -1,22 +1,53 @@
+import argparse
+import sys
+
 import numpy as np
 
 from bokeh.io import curdoc
 from bokeh.layouts import row, column
-from bokeh.models import ColumnDataSource, TextInput
+from bokeh.models import ColumnDataSource, TextInput, CustomJS
 from bokeh.plotting import figure
 from bokeh.models import Range1d
 from bokeh.models import HoverTool
-from itertools import starmap
 
 # FIXME: Imports like this are fragile in python 3 due to packages
 #        taking precedence over local files.
 from ui import float_eval
 from ui import SliderTextInputPair
 from ui import ShapeSelect
+from lattice import IndexGrid
+from intensity import intensity_image
+import commensurate
+
+def parse_args():
+	# arguments come from:  bokeh serve moire-bokeh --args [ARGS...]
+	parser = argparse.ArgumentParser(prog='bokeh serve moire-bokeh --args')
+	parser.add_argument('--client-transform', action='store_true',
+		help="apply layer 2's rotation, scale and translation in the browser."
+		" The server is then only consulted when the lattice points must be regenerated.")
+	parser.add_argument('--zoom', type=float, default=4.,
+		help='initial zoom; the view is 8*zoom wide. (default: 4)')
+	parser.add_argument('--max-points', type=int, default=20000,
+		help='maximum number of visible points per layer, beyond which only every'
+		' n-th lattice row and column are drawn. (default: 20000)')
+	parser.add_argument('--overlay-max-volume', type=int, default=5000,
+		help='largest supercell volume (in units of the primitive cell)'
+		' considered for the commensurate cell overlay. (default: 5000)')
+	parser.add_argument('--overlay-tolerance', type=float, default=0.05,
+		help='how close (in degrees) the rotation must be to a commensurate'
+		' angle for the overlay to be drawn. (default: 0.05)')
+	parser.add_argument('--intensity', action='store_true',
+		help='instead of drawing lattice points, draw the moire pattern as an'
+		' intensity map, whose size does not depend on the number of points.')
+	parser.add_argument('--resolution', type=int, default=400,
+		help='width and height in pixels of the intensity map. (default: 400)')
+	args = parser.parse_args(sys.argv[1:])
+	if args.intensity and args.client_transform:
+		parser.error('--intensity and --client-transform cannot be used together')
+	return args
 
 def main():
-	zoom = 4
-	index_radius = [30,30]
+	args = parse_args()
 
 	hover = HoverTool(
 		tooltips=[
@@ -28,12 +59,25 @@ def main():
 
 	# set up plot (styling in theme.yaml)
 	plot = figure(toolbar_location=None, title='test', tools=[hover])
-	source1 = ColumnDataSource(data=dict(x=[], y=[], i=[], j=[]))
-	source2 = ColumnDataSource(data=dict(x=[], y=[], i=[], j=[]))
-	plot.circle('x', 'y', source=source2, size=5, color='black')
-	plot.circle('x', 'y', source=source1, size=10)
-
-	controls = Controls()
+	if args.intensity:
+		image = ColumnDataSource(data=dict(image=[], x=[], y=[], dw=[], dh=[]))
+		plot.image(image='image', x='x', y='y', dw='dw', dh='dh', source=image, palette='Greys256')
+	else:
+		layer1 = Layer(1, args.max_points)
+		layer2 = (ClientTransformedLayer if args.client_transform else Layer)(2, args.max_points)
+		plot.circle('x', 'y', source=layer2.source, size=5, color='black')
+		plot.circle('x', 'y', source=layer1.source, size=10)
+
+	# outline of the nearest exactly commensurate supercell (if any)
+	overlay = ColumnDataSource(data=dict(x=[], y=[]))
+	plot.patch('x', 'y', source=overlay, fill_alpha=0.1, line_width=2, color='firebrick')
+	if not commensurate.available():
+		print('moire.exact could not be imported; the commensurate cell overlay is disabled')
+
+	# (the intensity map has a fixed size, so it can be zoomed out much further)
+	controls = Controls(zoom=args.zoom, max_zoom=(1000. if args.intensity else 50.))
+	if args.client_transform:
+		layer2.link_sliders(controls.slider_pairs)
 
 	# filler values; this is only to ensure that they are instances of Range1d.
 	plot.x_range = Range1d(0,1)
@@ -49,21 +93,9 @@ def main():
 		if None in direct_center: # an invalid value was typed
 			direct_center = [0., 0.]
 
-		def rotation_matrix(theta):
-			s,c = np.sin(theta), np.cos(theta)
-			return np.array([[c,-s],[s,c]])
-		def transform_cell(cell, rotation=0, scale=1):
-			return np.array(cell).dot(rotation_matrix(rotation).transpose())*scale
-
-		def cart_data(i, j, cell, shift):
-			ijs = np.column_stack([i, j]) + shift
-			xys = ijs.dot(cell)
-			x,y = xys.transpose()
-			return dict(x=x, y=y, i=i, j=j)
-
 		from math import radians
 		cell1 = controls.cell_1()
-		cell2 = transform_cell(controls.cell_2(),
+		transform = dict(
 			rotation=radians(controls.rotation()),
 			scale=(1 + controls.scale()),
 		)
@@ -72,31 +104,51 @@ def main():
 		# update range start and end in-place
 		#  to work around this: https://github.com/bokeh/bokeh/issues/4014
 		[cart_center] = np.array([direct_center]).dot(cell1)
-		plot.x_range.start = cart_center[0] - 4.*zoom
-		plot.x_range.end   = cart_center[0] + 4.*zoom
-		plot.y_range.start = cart_center[1] - 4.*zoom
-		plot.y_range.end   = cart_center[1] + 4.*zoom
-
-		def nearest_index(cell, cart):
-			direct = np.array([cart]).dot(np.linalg.inv(cell))
-			# note: numpy floats do not round to ints like python floats do
-			return [int(round(x)) for x in direct.flat]
-
-		def direct_coords(cell, cart_center):
-			index_center = nearest_index(cell, cart_center)
-			assert all(isinstance(x, int) for x in index_center)
-			def index_span(center, radius):
-				return np.arange(center-radius, center+radius+1)
-			I,J = starmap(index_span, zip(index_center, index_radius))
-			i,j = [x.reshape(-1) for x in np.meshgrid(I, J)]
-			return i,j
-
-		i1,j1 = direct_coords(cell1, cart_center)
-		i2,j2 = direct_coords(cell2, cart_center)
-		source1.data = cart_data(i1, j1, cell1, [0,0])
-		source1.data['layer'] = [1] * len(i1)
-		source2.data = cart_data(i2, j2, cell2, [controls.translation(), 0])
-		source2.data['layer'] = [2] * len(i1)
+		radius = 4. * (controls.zoom() or args.zoom)
+		view = (
+			cart_center[0] - radius, cart_center[0] + radius,
+			cart_center[1] - radius, cart_center[1] + radius,
+		)
+		set_if_changed(plot.x_range, start=view[0], end=view[1])
+		set_if_changed(plot.y_range, start=view[2], end=view[3])
+
+		if args.intensity:
+			cell2 = transform_cell(controls.cell_2(), **transform)
+			pixels = intensity_image(
+				cell1, [0, 0], cell2, np.dot([controls.translation(), 0], cell2),
+				view, (args.resolution, args.resolution),
+			)
+			image.data = dict(image=[pixels], x=[view[0]], y=[view[2]],
+				dw=[view[1] - view[0]], dh=[view[3] - view[2]])
+
+		elif args.client_transform:
+			# (each of these is a no-op if its inputs did not change)
+			layer1.update(cell1, view, [0,0])
+			layer2.update(controls.cell_2(), transform, view, controls.translation())
+		else:
+			layer1.update(cell1, view, [0,0])
+			cell2 = transform_cell(controls.cell_2(), **transform)
+			layer2.update(cell2, view, [controls.translation(), 0])
+
+		found = commensurate.commensurate_supercell(
+			controls.cell_1(), controls.cell_2(),
+			max_volume=args.overlay_max_volume,
+			tolerance=radians(args.overlay_tolerance),
+			**transform
+		)
+		if found is None:
+			set_if_changed(plot.title, text='no commensurate cell nearby')
+			if len(overlay.data['x']):
+				overlay.data = dict(x=[], y=[])
+		else:
+			(record, c_matrix, supercell) = found
+			set_if_changed(plot.title, text='commensurate at {:.4f}°: β={} (a,b,c)=({},{},{}), C={}, volume {}'.format(
+				np.degrees(record.angle), record.β, record.a, record.b, record.c,
+				[list(row) for row in c_matrix], c_matrix[0][0] * c_matrix[1][1],
+			))
+			(x, y) = commensurate.supercell_outline(supercell, cart_center)
+			if not (np.array_equal(x, overlay.data['x']) and np.array_equal(y, overlay.data['y'])):
+				overlay.data = dict(x=x, y=y)
 
 	def callback(i, dont, care):
 		update()
@@ -114,6 +166,112 @@ def main():
 	curdoc().add_root(root)
 	curdoc().title = "Moire"
 
+def rotation_matrix(theta):
+	s,c = np.sin(theta), np.cos(theta)
+	return np.array([[c,-s],[s,c]])
+
+def transform_cell(cell, rotation=0, scale=1):
+	return np.array(cell).dot(rotation_matrix(rotation).transpose())*scale
+
+def set_if_changed(model, **props):
+	# every assignment is sent to the browser, even if the value is the same
+	for (name, value) in props.items():
+		if getattr(model, name) != value:
+			setattr(model, name, value)
+
+class Layer:
+	# The points of one lattice, in a ColumnDataSource.
+	#
+	# Only points inside (roughly) the visible rectangle are generated,
+	#  thinned out if there are more than max_points.  (see lattice.py)
+	# 'i', 'j' and 'layer' only change when IndexGrid decides that the
+	#  points must be regenerated;  everything else is a change to 'x'/'y'
+	#  alone, which is sent to the browser as a single partial update.
+	def __init__(self, number, max_points):
+		self.number = number
+		self._grid = IndexGrid(max_points)
+		self._inputs = None
+		self.source = ColumnDataSource(data=dict(x=[], y=[], i=[], j=[], layer=[]))
+
+	def _grid_columns(self):
+		(i, j) = (self._grid.i, self._grid.j)
+		return dict(i=i, j=j, layer=[self.number] * len(i))
+
+	def update(self, cell, view, shift):
+		cell = np.array(cell, dtype=float)
+		inputs = (cell.tobytes(), tuple(view), tuple(shift))
+		if inputs == self._inputs:
+			return
+		self._inputs = inputs
+
+		changes = {}
+		if self._grid.update(cell, shift, view):
+			changes.update(self._grid_columns())
+
+		xys = (np.column_stack([self._grid.i, self._grid.j]) + shift).dot(cell)
+		changes.update(x=xys[:,0], y=xys[:,1])
+		self.source.data.update(changes)
+
+class ClientTransformedLayer(Layer):
+	# A Layer whose rotation, scale and translation are applied by the browser.
+	#
+	# In addition to 'x' and 'y', the source holds 'x0' and 'y0', the points
+	#  of the untransformed cell.  A CustomJS callback on the sliders recomputes
+	#  'x' and 'y' from these in place.  The server is only told about a slider
+	#  once it is released, and only sends new data when the lattice points
+	#  must be regenerated or the cell shape changed.
+	JS_CODE = '''
+		var d = source.data;
+		var a = first_row.data;
+		var t = translation.value;
+		var r = rotation.value * Math.PI / 180;
+		var c = Math.cos(r) * (1 + scale.value);
+		var s = Math.sin(r) * (1 + scale.value);
+		for (var k = 0; k < d['x0'].length; k++) {
+			var X = d['x0'][k] + t * a['x'][0];
+			var Y = d['y0'][k] + t * a['y'][0];
+			d['x'][k] = c * X - s * Y;
+			d['y'][k] = s * X + c * Y;
+		}
+		source.change.emit();
+	'''
+
+	def __init__(self, number, max_points):
+		super().__init__(number, max_points)
+		self.source.data.update(x0=[], y0=[])
+		# the first row of the untransformed cell; translation is along it
+		self.first_row = ColumnDataSource(data=dict(x=[0.], y=[0.]))
+
+	def link_sliders(self, slider_pairs):
+		names = ['rotation', 'scale', 'translation']
+		callback = CustomJS(code=self.JS_CODE, args=dict(
+			source=self.source, first_row=self.first_row,
+			**{name: slider_pairs[name].slider() for name in names}
+		))
+		for name in names:
+			slider_pairs[name].js_on_change(callback)
+			# the server still needs to hear about the final value (to regenerate
+			#  points and find the overlay), but not about every tick in between
+			slider_pairs[name].throttle_server_callback()
+
+	def update(self, cell, transform, view, translation):
+		cell = np.array(cell, dtype=float)
+		regenerated = self._grid.update(transform_cell(cell, **transform), [translation, 0], view)
+		if not regenerated and cell.tobytes() == self._inputs:
+			return # the browser takes care of it
+		self._inputs = cell.tobytes()
+
+		# (the index grid and both sets of coordinates are all replaced)
+		ijs = np.column_stack([self._grid.i, self._grid.j])
+		xys0 = ijs.dot(cell)
+		xys = (ijs + [translation, 0]).dot(transform_cell(cell, **transform))
+		self.first_row.data = dict(x=cell[:1,0], y=cell[:1,1])
+		self.source.data.update(
+			x0=xys0[:,0], y0=xys0[:,1],
+			x=xys[:,0], y=xys[:,1],
+			**self._grid_columns()
+		)
+
 
 class Controls:
 	# NOTE:
@@ -121,17 +279,19 @@ class Controls:
 	#  see because most of it is automatically generated. It is:
 	# * self.model             : the bokeh model containing all widgets
 	# * self.set_callback(cb)  : to be called once the callback is created
+	# * self.slider_pairs      : the SliderTextInputPairs, by attr
 	# * self.scale(), self.rotation(), ...
 	#          : automatically generated by the attr="..."
 	#            arguments in __init__, for use in the callback.
 
-	def __init__(self):
+	def __init__(self, zoom, max_zoom):
 
 		# The helper functions automatically set up callbacks,
 		#  and add attributes (e.g. self.scale)
 
+		self.slider_pairs = {}
 		def slider_pair(attr, **kw):
-			widget = SliderTextInputPair(**kw)
+			widget = self.slider_pairs[attr] = SliderTextInputPair(**kw)
 			setattr(self, attr, lambda: widget.value)
 			# this lambda is because self._callback doesn't exist yet
 			widget.add_callback(lambda a,b,c: self._callback(a,b,c))
@@ -170,6 +330,12 @@ class Controls:
 			start=0.0, end=0.5, step=0.0001,
 			)
 
+		zoom = slider_pair(
+			title="Zoom", attr='zoom',
+			type=float_eval, value=zoom,
+			start=0.5, end=max(max_zoom, zoom), step=0.01,
+			)
+
 		center_i = text_input(
 			title="Viewpoint Center I", attr='center_i',
 			type=float_eval, value="0",
@@ -186,7 +352,7 @@ class Controls:
 		self.model = \
 			column(
 				column(scale, rotation, translation),
-				row(center_i, center_j),
+				column(zoom, row(center_i, center_j)),
 				column(shape_1, shape_2),
 			)
 
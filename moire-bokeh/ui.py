@@ -26,6 +26,8 @@ class SliderTextInputPair:
 
 		self.value = value
 		self.model = row(self._slider, self._input)
+		# the slider property that the server listens to
+		self._slider_event = 'value'
 
 	def _slider_cb(self, attr, old, new):
 		self.value = new
@@ -41,9 +43,9 @@ class SliderTextInputPair:
 	def _set_slider_value(self, value):
 		# NOTE: This assumes bound methods for the same instance always
 		#       have the same id; I don't know if this is guaranteed.
-		self._slider.remove_on_change('value', self._slider_cb)
+		self._slider.remove_on_change(self._slider_event, self._slider_cb)
 		self._slider.value = value
-		self._slider.on_change('value', self._slider_cb)
+		self._slider.on_change(self._slider_event, self._slider_cb)
 
 	def _set_input_value(self, value):
 		self._input.remove_on_change('value', self._input_cb)
@@ -52,9 +54,27 @@ class SliderTextInputPair:
 
 	def add_callback(self, callback):
 		self._callback = callback
-		self._slider.on_change('value', self._slider_cb)
+		self._slider.on_change(self._slider_event, self._slider_cb)
 		self._input.on_change('value', self._input_cb)
 
+	# For CustomJS callbacks, which run in the browser.
+	# (values typed into the text input reach the slider through the server)
+	def slider(self): return self._slider
+
+	def js_on_change(self, callback):
+		self._slider.js_on_change('value', callback)
+
+	def throttle_server_callback(self):
+		# Only tell the server about the slider once it is released,
+		#  for when the browser keeps up with it through js_on_change.
+		#  (older versions of bokeh have no value_throttled, and keep 'value')
+		if 'value_throttled' not in self._slider.properties():
+			return
+		if hasattr(self, '_callback'):
+			self._slider.remove_on_change(self._slider_event, self._slider_cb)
+			self._slider.on_change('value_throttled', self._slider_cb)
+		self._slider_event = 'value_throttled'
+
 class ShapeSelect:
 
 	def __init__(self, **kw):
@@ -1 +1,6 @@
-from . import exact
+# moire.exact is imported on first access (PEP 562), as it is not cheap.
+def __getattr__(name):
+	if name == 'exact':
+		import importlib
+		return importlib.import_module('.exact', __name__)
+	raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
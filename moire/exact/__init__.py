@@ -5,37 +5,101 @@ __all__ = '''
 	MoirePattern
 	is_squarefree
 	find_nicer_cell
+	find_nicer_cells
+	RotationMoire
+	enumerate_rotation_moires
+	SpecialReflectionMoire
+	enumerate_special_reflection_moires
+	dump_patterns
+	load_patterns
+	AngleTable
+	angle_table
+	MappedAngleTable
+	build_rotation_table
+	save_rotation_table
+	SiteChunk
+	supercell_sites
+	write_poscar
+	write_xyz
+	ApproximateRotation
+	approximate_rotation
 '''.split()
 
-from .pattern import MoirePattern
-from .util import is_squarefree
+# Everything defined in a submodule is imported on first access (PEP 562),
+#  so that e.g. enumerate_rotation_moires can be used without paying
+#  for an import of sympy.
+_LAZY = {
+	'MoirePattern':              'pattern',
+	'is_squarefree':             'util',
+	'RotationMoire':             'enumerate',
+	'enumerate_rotation_moires': 'enumerate',
+	'SpecialReflectionMoire':    'enumerate',
+	'enumerate_special_reflection_moires': 'enumerate',
+	'dump_patterns':             'serialize',
+	'load_patterns':             'serialize',
+	'AngleTable':                'tables',
+	'angle_table':               'tables',
+	'MappedAngleTable':          'tables',
+	'build_rotation_table':      'tables',
+	'save_rotation_table':       'tables',
+	'SiteChunk':                 'structure',
+	'supercell_sites':           'structure',
+	'write_poscar':              'structure',
+	'write_xyz':                 'structure',
+	'ApproximateRotation':       'approx',
+	'approximate_rotation':      'approx',
+}
+
+def __getattr__(name):
+	import importlib
+	if name not in _LAZY:
+		raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+	value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+	globals()[name] = value
+	return value
+
+def __dir__():
+	return sorted(set(globals()) | set(__all__))
 
 # Aesthetically speaking, cells where the two diagonals (geometrically speaking)
 # have similar length look nicer.
-def find_nicer_cell(mat):
-	from sympy import Matrix
-	from moire.util import window2, iterate
-	MAX_MULT = 2
-	def neighborhood(mat):
-		for i,j in [(0,1), (1,0)]:
-			# deliberately produces at least one copy of mat itself
-			#  in case we're at the fixed point
-			for mult in range(-MAX_MULT, MAX_MULT+1):
-				m = Matrix(mat)
-				m.zip_row_op(i,j, lambda a,b: a+mult*b)
-				yield m
-
-	# Ugliness is proportional to square sum of diagonal lengths;
-	# (u+v).(u+v) + (u-v).(u-v)  ~  u.u + v.v
-	ugliness      = lambda m: sum(x**2 for x in m)
-	best_neighbor = lambda m: min(neighborhood(m), key=ugliness)
-
-	for (old,new) in window2(iterate(best_neighbor, mat)):
-		if ugliness(old) <= ugliness(new):
-			return old
-	assert False, 'unreachable'
+#
+# Ugliness is proportional to square sum of diagonal lengths;
+# (u+v).(u+v) + (u-v).(u-v)  ~  u.u + v.v
+# which Lagrange-Gauss reduction minimizes over all equivalent cells.
+def find_nicer_cell(mat, metric=None):
+	'''
+	Get the least ugly matrix related to ``mat`` by a unimodular
+	transformation on the left.  The determinant is preserved.
+
+	``mat`` may be rational;  it is reduced as an integer matrix over the
+	 common denominator of its entries.  Anything else is a ValueError.
+	Lengths of rows are measured with the rational Gram matrix ``metric``,
+	 which defaults to the identity (i.e. ugliness of the matrix itself).
+	'''
+	from sympy import Matrix, ilcm
+	from .hnf import lagrange_reduce
+	mat = Matrix(mat)
+	if not all(x.is_Rational for x in mat):
+		raise ValueError('find_nicer_cell: matrix must be rational')
+	denom = ilcm(*(x.q for x in mat))
+	metric = None if metric is None else [[_to_fraction(x) for x in row] for row in Matrix(metric).tolist()]
+	return Matrix(lagrange_reduce((mat * denom).tolist(), metric)) / denom
+
+def find_nicer_cells(mats):
+	''' find_nicer_cell for an integer array of shape (N, 2, 2).  Returns a NumPy array. '''
+	from .hnf import lagrange_reduce_batch
+	return lagrange_reduce_batch(mats)
+
+def _to_fraction(x):
+	from fractions import Fraction
+	if not x.is_Rational:
+		raise ValueError('find_nicer_cell: metric must be rational')
+	return Fraction(int(x.p), int(x.q))
 
 # yer all public
-from .constants import * # noqa
 from .constants import __all__ as tmp
+for name in tmp:
+	_LAZY[name] = 'constants'
 __all__ += tmp
+del name, tmp
@@ -0,0 +1,128 @@
+from collections import namedtuple
+from fractions import Fraction
+from math import asin, atan2, cos, gcd, inf, pi, sin, sqrt, tan
+
+from .enumerate import rotation_e_inverse
+from .hnf import supercell_hnf
+from moire.util import public
+
+__doc__ = '''
+Search for small commensurate supercells near a measured twist angle.
+
+Commensurate rotations of prim_rotation_cell(β) correspond one-to-one with
+ coprime pairs (m, n), through  tan(angle/2) = sqrt(β) n/m.  The search walks
+ the Stern-Brocot tree of n/m, visiting only the fractions that lie within
+ the angle window allowed by the strain budget, and stops descending once
+ the rotation is too large to fit the volume bound.
+'''
+
+@public
+class ApproximateRotation(namedtuple('ApproximateRotation', 'β a b c scale angle strain c_matrix volume')):
+	'''
+	A commensurate pattern near some target:  prim_rotation_cell(β) and the same
+	 cell rotated by ``angle`` (cos = a/c, sin = b sqrt(β)/c) and scaled by the
+	 rational ``scale``.
+
+	strain is  |(scale/target_scale) exp(i (angle - target_angle)) - 1|,
+	 i.e. the relative size of the deformation that turns the target into this.
+	'''
+	__slots__ = ()
+
+	def moire_pattern(self):
+		''' Construct the corresponding MoirePattern. '''
+		from sympy import Rational, eye
+		from .build import prim_rotation_moire_abc
+		pattern = prim_rotation_moire_abc(β=self.β, a=self.a, b=self.b, c=self.c)
+		if self.scale != 1:
+			scale = Rational(self.scale.numerator, self.scale.denominator)
+			pattern = pattern.visit_family(None, scale * eye(2))
+		return pattern
+
+def _stern_brocot(lo, hi, too_big):
+	'''
+	Coprime (n, m) with  lo <= n/m <= hi,  for all of which too_big(n, m) is False.
+	too_big must be monotonic: true for (n, m) implies true for (n + n', m + m').
+	'''
+	stack = [((0, 1), (1, 0))]
+	while stack:
+		(left, right) = stack.pop()
+		(n, m) = (left[0] + right[0], left[1] + right[1])
+		if too_big(n, m):
+			continue
+		if n < lo * m:
+			stack.append(((n, m), right))
+		elif n > hi * m:
+			stack.append((left, (n, m)))
+		else:
+			yield (n, m)
+			stack.append((left, (n, m)))
+			stack.append(((n, m), right))
+
+def _scale_candidates(scale, max_strain, max_denominator):
+	''' Rationals u/w (w <= max_denominator) within a relative distance max_strain of scale. '''
+	out = set()
+	for w in range(1, max_denominator + 1):
+		lo = int(scale * (1 - max_strain) * w)
+		for u in range(max(lo, 1), int(scale * (1 + max_strain) * w) + 2):
+			if abs(u / w - scale) <= scale * max_strain:
+				out.add(Fraction(u, w))
+	return sorted(out)
+
+@public
+def approximate_rotation(β, angle, *, max_strain, max_volume, scale=1, max_scale_denominator=1):
+	'''
+	Find commensurate rotations (optionally with a rational scale) of
+	 prim_rotation_cell(β) near a target rotation by ``angle`` (radians,
+	 0 < angle < pi) with scale factor ``scale``.
+
+	Returns a list of ApproximateRotation with  strain <= max_strain  and
+	 volume <= max_volume, sorted by volume, then strain.  Scales are
+	 restricted to fractions with denominator <= max_scale_denominator,
+	 so by default only pure rotations are considered.
+	'''
+	if not 0 < angle < pi:
+		raise ValueError('approximate_rotation: angle must lie strictly between 0 and pi')
+	if max_strain < 0 or scale <= 0:
+		raise ValueError('approximate_rotation: max_strain and scale must be positive')
+
+	# det(C F) is an integer and det(F) == (w/u)^2 for a scale u/w,
+	#  so u*u divides the volume.
+	scales = [λ for λ in _scale_candidates(scale, max_strain, max_scale_denominator)
+		if λ.numerator**2 <= max_volume]
+	if not scales:
+		return []
+
+	# |s e^{iΔ} - 1| >= s |sin Δ|  and  s >= 1 - max_strain,  which bounds Δ.
+	sine = max_strain / (1 - max_strain) if max_strain < 1 else 1
+	window = asin(sine) if sine < 1 else pi
+	root_β = sqrt(β)
+	x_bound = lambda θ: tan(θ / 2) / root_β if θ < pi else inf
+	(lo, hi) = (x_bound(max(angle - window, 0)), x_bound(min(angle + window, pi)))
+
+	# The first row of C must clear the denominators of the first row of F,
+	#  so for a scale u/w the volume is at least  c u / gcd(c, w) >= c u / w.
+	#  Also,  c >= (m*m + β*n*n) / 2β.
+	c_bound = max_volume * max(x.denominator / x.numerator for x in scales)
+	too_big = lambda n, m: m*m + β*n*n > 2 * β * c_bound
+
+	out = []
+	for (n, m) in _stern_brocot(lo, hi, too_big):
+		(a, b, c) = (m*m - β*n*n, 2*m*n, m*m + β*n*n)
+		g = gcd(gcd(a, b), c)
+		(a, b, c) = (a // g, b // g, c // g)
+		if c > c_bound:
+			continue
+		θ = atan2(b * root_β, a)
+		f = rotation_e_inverse(β, a, b, c)
+		for λ in scales:
+			ratio = float(λ) / scale
+			strain = abs(complex(ratio * cos(θ - angle) - 1, ratio * sin(θ - angle)))
+			if strain > max_strain or c * λ.numerator > max_volume * gcd(c, λ.denominator):
+				continue
+			cmat = supercell_hnf([[x / λ for x in row] for row in f])
+			volume = cmat[0][0] * cmat[1][1]
+			if volume <= max_volume:
+				out.append(ApproximateRotation(β, a, b, c, λ, θ, strain, cmat, volume))
+
+	out.sort(key=lambda r: (r.volume, r.strain))
+	return out
@@ -0,0 +1,176 @@
+from collections import namedtuple
+
+import numpy as np
+
+from .enumerate import rotation_e_inverse
+from .hnf import supercell_hnf
+from moire.util import public
+
+__doc__ = '''
+Vectorized computation of commensurate supercells for many rotations at once.
+
+This is meant for coarse screening;  the same integer algorithm as
+ hnf.supercell_hnf is applied elementwise over NumPy arrays, and full
+ MoirePattern objects can be constructed later for whatever survives.
+'''
+
+# Inputs at or above this are handled with python ints instead, since
+#  intermediate products of two such numbers would overflow int64.
+INT64_INPUT_LIMIT = 2**30
+
+@public
+class SupercellBatch(namedtuple('SupercellBatch', 'c_matrix d_matrix volume')):
+	'''
+	c_matrix and d_matrix have shape (N, 2, 2) and volume has shape (N,).
+	The dtype is int64, or object (python ints) if any value is too large.
+	'''
+	__slots__ = ()
+
+def _modinv(x, m):
+	''' Elementwise inverse of x modulo m, where gcd(x, m) == 1.  (0 when m == 1) '''
+	(r0, r1) = (m, x % m)
+	(s0, s1) = (np.zeros_like(m), np.ones_like(m))
+	while (r1 != 0).any():
+		live = r1 != 0
+		q = r0 // np.where(live, r1, 1)
+		(r0, r1) = (np.where(live, r1, r0), np.where(live, r0 - q * r1, r1))
+		(s0, s1) = (np.where(live, s1, s0), np.where(live, s0 - q * s1, s1))
+	return s0 % m
+
+def _congruence_hnf(n0, n1, d):
+	''' Elementwise hnf.congruence_hnf.  Returns (h00, h10, h11). '''
+	g = np.gcd(np.gcd(n0, n1), d)
+	(n0, n1, d) = (n0 // g, n1 // g, d // g)
+	g0 = np.gcd(n0, d)
+	h00 = d // g0
+	h10 = (-n1 % h00) * _modinv(n0 // g0 % h00, h00) % h00
+	return (h00, h10, g0)
+
+def _supercell_hnf(n, d):
+	'''
+	Elementwise hnf.supercell_hnf for F == n / d, where n has shape (2, 2, N).
+	All entries of n should already be reduced modulo d.
+	'''
+	(b00, b10, b11) = (np.ones_like(d), np.zeros_like(d), np.ones_like(d))
+	for col in range(2):
+		# the column, expressed in the current basis (reduced mod d to stay small)
+		n0 = b00 % d * n[0][col] % d
+		n1 = (b10 % d * n[0][col] + b11 % d * n[1][col]) % d
+		(h00, h10, h11) = _congruence_hnf(n0, n1, d)
+		(b00, b10, b11) = (h00 * b00, h10 * b00 + h11 * b10, h11 * b11)
+	return (b00, b10 % b00, b11)
+
+def _int_array(x):
+	''' int64 if possible, otherwise python ints. '''
+	x = np.asarray(x)
+	if x.dtype.kind in 'iu':
+		return x.astype(np.int64)
+	return x.astype(object)
+
+def _python_row(β, a, b, c, k):
+	''' Fallback for a single row, using python ints. '''
+	f = rotation_e_inverse(β, a, b, c, k)
+	cmat = supercell_hnf(f)
+	dmat = [[int(sum(cmat[i][m] * f[m][j] for m in range(2))) for j in range(2)] for i in range(2)]
+	return (cmat, dmat, cmat[0][0] * cmat[1][1])
+
+@public
+def rotation_supercells(β, a, b, c, k=None):
+	'''
+	Commensurate supercells of prim_rotation_cell(β) for many rotations.
+
+	a, b, c (and optionally k) are integer arrays of equal shape (N,),
+	 describing the (scaled) rotations with  cos = a/c,  sin = b sqrt(β)/c;
+	 they must satisfy  a*a + β*b*b == k*c*c  (k defaults to 1).
+
+	Returns a SupercellBatch of the HNF matrices C, the matrices D = C E^-1
+	 (such that CA == DB), and the volumes det(C).
+	'''
+	β = int(β)
+	(a, b, c) = (_int_array(x) for x in (a, b, c))
+	k = np.ones(c.shape, dtype=np.int64) if k is None else _int_array(k)
+	if not a.shape == b.shape == c.shape == k.shape or a.ndim != 1:
+		raise ValueError('rotation_supercells: a, b, c, k must be 1D arrays of equal length')
+	if (c <= 0).any() or (k <= 0).any():
+		raise ValueError('rotation_supercells: c and k must be positive')
+
+	# (written so as to not overflow)
+	L = INT64_INPUT_LIMIT
+	big = (abs(a) >= L) | (abs(b) >= L // β) | (c >= L // k)
+	big = np.asarray(big, dtype=bool)
+	small = ~big
+	(sa, sb, sc, sk) = (x[small].astype(np.int64) for x in (a, b, c, k))
+	sd = sk * sc
+	if (sa * sa + β * sb * sb != sk * sc * sc).any():
+		raise ValueError('rotation_supercells: a*a + β*b*b != k*c*c')
+
+	# F = E^-1 = n / d
+	n = [[sa % sd, -sb % sd], [β * sb % sd, sa % sd]]
+	(c00, c10, c11) = _supercell_hnf(n, sd)
+
+	# D = C F.  Its entries are small, but the products in C n might not be;
+	#  rows where they could overflow are redone with python ints below.
+	cmax = np.maximum(c00, c11)
+	fits = cmax < 2**62 // (2 * np.maximum(np.maximum(abs(sa), abs(β * sb)), 1))
+	(fn00, fn01, fn10, fn11) = (sa, -sb, β * sb, sa)
+	dmat = np.zeros((len(sa), 2, 2), dtype=np.int64)
+	with np.errstate(over='ignore'):
+		dmat[:, 0, 0] = c00 * fn00 // sd
+		dmat[:, 0, 1] = c00 * fn01 // sd
+		dmat[:, 1, 0] = (c10 * fn00 + c11 * fn10) // sd
+		dmat[:, 1, 1] = (c10 * fn01 + c11 * fn11) // sd
+		volume = c00 * c11
+	fits &= c11 < 2**62 // c00
+
+	cmat = np.zeros((len(sa), 2, 2), dtype=np.int64)
+	(cmat[:, 0, 0], cmat[:, 1, 0], cmat[:, 1, 1]) = (c00, c10, c11)
+
+	redo = np.flatnonzero(big)
+	redo_small = np.flatnonzero(small)[~fits]
+	if not len(redo) and not len(redo_small):
+		return SupercellBatch(cmat, dmat, volume)
+
+	# overflow fallback: switch to python ints
+	out_c = np.zeros((len(a), 2, 2), dtype=object)
+	out_d = np.zeros((len(a), 2, 2), dtype=object)
+	out_v = np.zeros(len(a), dtype=object)
+	(out_c[small], out_d[small], out_v[small]) = (cmat.astype(object), dmat.astype(object), volume.astype(object))
+	for i in np.concatenate([redo, redo_small]):
+		(ci, di, vi) = _python_row(β, int(a[i]), int(b[i]), int(c[i]), int(k[i]))
+		(out_c[i], out_d[i], out_v[i]) = (np.array(ci, dtype=object), np.array(di, dtype=object), vi)
+	return SupercellBatch(out_c, out_d, out_v)
+
+@public
+def valid_supercell_mask(c_matrix, mats):
+	'''
+	Test many integer matrices at once for being valid replacements of
+	 the HNF supercell matrix C.  (see MoirePattern.is_valid_primitive_supercell)
+
+	mats is an integer array of shape (N, 2, 2).  Returns a boolean array of
+	 shape (N,).  M is valid iff C M^-1 is unimodular;  i.e. iff
+	 |det M| == det C  and  C adj(M) == 0  (mod det M).
+	'''
+	m = _int_array(mats)
+	if m.ndim != 3 or m.shape[1:] != (2, 2):
+		raise ValueError('valid_supercell_mask: expected an array of shape (N, 2, 2)')
+	((c00, c01), (c10, c11)) = [[int(x) for x in row] for row in c_matrix]
+	volume = abs(c00 * c11 - c01 * c10)
+	cmax = max(abs(c00), abs(c01), abs(c10), abs(c11), 1)
+
+	# (written so as to not overflow)
+	mmax = int(abs(m).max()) if m.size else 0
+	if m.dtype == object or mmax >= 2**31 or cmax >= 2**61 // max(mmax, 1):
+		m = m.astype(object)
+
+	(m00, m01, m10, m11) = (m[:, 0, 0], m[:, 0, 1], m[:, 1, 0], m[:, 1, 1])
+	det = m00 * m11 - m01 * m10
+	mask = abs(det) == volume
+	if not volume:
+		return np.asarray(mask, dtype=bool)
+	det = np.where(mask, det, 1)
+
+	# C adj(M), where adj(M) = [[m11, -m01], [-m10, m00]]
+	for (x, y) in [(c00, c01), (c10, c11)]:
+		mask &= (x * m11 - y * m10) % det == 0
+		mask &= (y * m00 - x * m01) % det == 0
+	return np.asarray(mask, dtype=bool)
@@ -4,9 +4,12 @@ from sympy import ImmutableMatrix, Tuple
 from sympy import gcd, sqrt
 from sympy import simplify
 
+import functools
 import itertools
 
 from .pattern import MoirePattern
+from .cache import cached_constructor
+from .instrument import timed
 from .util import undummy, is_squarefree
 from moire.util import public
 
@@ -32,6 +35,7 @@ def reflection_cart(*, sine=S('s'), cosine=S('t')):
 #       my moire paper.
 
 @public
+@cached_constructor
 def prim_rotation_moire_abc(*, β=Symbol('β'), a=S('a'), b=S('b'), c=S('c')):
 	(a,b,c,β) = map(S, (a,b,c,β))
 	if not any(x.free_symbols for x in (a,b,c,β)):
@@ -44,6 +48,7 @@ def prim_rotation_moire_abc(*, β=Symbol('β'), a=S('a'), b=S('b'), c=S('c')):
 	return MoirePattern.from_opers(amat, cart=mmat)
 
 @public
+@cached_constructor
 def prim_scaled_rotation_moire_abck(*, β=Symbol('β'), a=S('a'), b=S('b'), c=S('c'), k=S('k')):
 	# FIXME this is currently mostly a copy-paste of prim_rotation_moire_abc
 	#  which differs in no discernable way except assertions, which are
@@ -68,6 +73,7 @@ def prim_rotation_moire_pq(*, β, p=S('p'), q=S('q')):
 	return prim_rotation_moire_abc(β=β, a=a, b=b, c=c)
 
 @public
+@cached_constructor
 def prim_special_reflection_moire(*, t=S('t')):
 	t = S(t)
 	amat = prim_special_reflection_cell(cosine=t)
@@ -90,12 +96,9 @@ def prim_special_reflection_moire(*, t=S('t')):
 #   Cambridge University Press, Cambridge, 1998.
 # Provided by sympy
 @public
+@timed('rotation_diophantine_triple')
 def rotation_diophantine_triple(β, p=S('p'), q=S('q')):
-	from sympy.solvers.diophantine import parametrize_ternary_quadratic
-	from sympy import Dummy
-	x,y,z = map(Dummy, 'x y z'.split(' '))
-	sol = parametrize_ternary_quadratic(x*x + β*y*y - z*z)
-	sol = Tuple(*undummy(sol)) # replace dummy p and q
+	sol = _rotation_parametrization(S(β))
 	sol = sol.subs({S('p'): p, S('q'): q})
 
 	# conditions on p and q are not entirely clear;  beta=3, p=1, q=1
@@ -103,6 +106,21 @@ def rotation_diophantine_triple(β, p=S('p'), q=S('q')):
 	(a,b,c) = sol
 	if not sol.free_symbols:
 		assert gcd(a,β*b) == gcd(c,β*b) == gcd(a,c) == 1
+	return sol
+
+# The general solution only depends on β, and producing it is far more
+#  expensive than substituting p and q into it.
+@functools.lru_cache(maxsize=64)
+@timed('rotation_parametrization') # (only counts cache misses)
+def _rotation_parametrization(β):
+	try:
+		from sympy.solvers.diophantine import parametrize_ternary_quadratic
+	except ImportError: # moved in sympy 1.7
+		from sympy.solvers.diophantine.diophantine import parametrize_ternary_quadratic
+	from sympy import Dummy
+	x,y,z = map(Dummy, 'x y z'.split(' '))
+	sol = parametrize_ternary_quadratic(x*x + β*y*y - z*z)
+	sol = Tuple(*undummy(sol)) # replace dummy p and q
 
 	# ...there doesn't seem to be a way to tell parametrize_ternary_quadratic
 	#  what order my variables are in. It literally just... *guesses*.
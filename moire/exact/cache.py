@@ -0,0 +1,201 @@
+from contextlib import contextmanager
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+
+from moire.util import public
+
+__doc__ = '''
+Opt-in persistent cache of constructed MoirePatterns.
+
+When enabled, the constructors in build.py that are decorated with
+ ``cached_constructor`` look up their (fully numeric) arguments in an
+ SQLite database before doing any work.  The database is safe to share
+ between processes; least recently used entries are evicted once the
+ stored data exceeds a size limit.
+
+The cache is enabled by calling enable_cache(), or by setting the
+ environment variable MOIRE_CACHE_DIR (which also reaches worker processes).
+
+Keys include a hash of the source code of the constructor and of the
+ modules that implement MoirePattern, so that entries computed by an
+ older version of the algorithm are never served.
+'''
+
+# bump this whenever the stored representation changes
+FORMAT_VERSION = 2
+# modules whose code can affect the value of a constructed pattern
+ALGORITHM_MODULES = ('build', 'pattern', 'hnf', 'field')
+DEFAULT_MAX_BYTES = 256 * 2**20
+DB_FILENAME = 'patterns.sqlite'
+
+# directory is None when not configured (so the environment decides),
+#  and False when explicitly disabled.
+_config = {'directory': None, 'max_bytes': DEFAULT_MAX_BYTES}
+_connection = {'pid': None, 'path': None, 'conn': None}
+
+@public
+def enable_cache(directory=None, max_bytes=DEFAULT_MAX_BYTES):
+	'''
+	Turn on the on-disk cache.  directory defaults to $MOIRE_CACHE_DIR,
+	 or ~/.cache/moire.
+	'''
+	if directory is None:
+		directory = os.environ.get('MOIRE_CACHE_DIR') or os.path.expanduser('~/.cache/moire')
+	_config['directory'] = directory
+	_config['max_bytes'] = max_bytes
+
+@public
+def disable_cache():
+	_config['directory'] = False
+	_close()
+
+@public
+def cache_directory():
+	''' The directory currently used for the cache, or None if it is disabled. '''
+	if _config['directory'] is None:
+		return os.environ.get('MOIRE_CACHE_DIR') or None
+	return _config['directory'] or None
+
+@public
+def clear_cache():
+	''' Delete every entry in the current cache. '''
+	conn = _connect()
+	if conn is not None:
+		with _transaction(conn):
+			conn.execute('DELETE FROM patterns')
+			conn.execute("UPDATE meta SET value = 0 WHERE name = 'total_size'")
+
+@contextmanager
+def _transaction(conn):
+	# IMMEDIATE takes the write lock up front, so that concurrent
+	#  writers wait on each other (up to the connection timeout)
+	#  rather than failing partway through.
+	conn.execute('BEGIN IMMEDIATE')
+	try:
+		yield
+	except:
+		conn.execute('ROLLBACK')
+		raise
+	conn.execute('COMMIT')
+
+def _close():
+	# (a connection inherited across a fork belongs to the parent; just drop it)
+	if _connection['conn'] is not None and _connection['pid'] == os.getpid():
+		_connection['conn'].close()
+	_connection.update(pid=None, path=None, conn=None)
+
+def _connect():
+	directory = cache_directory()
+	if directory is None:
+		return None
+	path = os.path.join(directory, DB_FILENAME)
+	# sqlite connections must not be carried across a fork
+	if _connection['conn'] is not None and _connection['pid'] == os.getpid() and _connection['path'] == path:
+		return _connection['conn']
+
+	_close()
+	os.makedirs(directory, exist_ok=True)
+	conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+	conn.execute('PRAGMA journal_mode=WAL')
+	with _transaction(conn):
+		conn.execute('''CREATE TABLE IF NOT EXISTS patterns (
+			key TEXT PRIMARY KEY, value BLOB NOT NULL,
+			size INTEGER NOT NULL, accessed REAL NOT NULL)''')
+		conn.execute('CREATE INDEX IF NOT EXISTS patterns_accessed ON patterns (accessed)')
+		conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+		conn.execute("INSERT OR IGNORE INTO meta VALUES ('total_size', 0)")
+	_connection.update(pid=os.getpid(), path=path, conn=conn)
+	return conn
+
+@functools.lru_cache(maxsize=None)
+def _source_hash(func):
+	''' Hash of the code that determines the output of the constructor func. '''
+	import importlib
+	digest = hashlib.sha256(inspect.getsource(func).encode())
+	for name in ALGORITHM_MODULES:
+		module = importlib.import_module('.' + name, __package__)
+		digest.update(inspect.getsource(module).encode())
+	return digest.hexdigest()[:16]
+
+def _canonical_key(func, kw):
+	from sympy import srepr
+	args = ','.join('{}={}'.format(k, srepr(v)) for (k, v) in sorted(kw.items()))
+	return 'v{}-{}:{}.{}({})'.format(
+		FORMAT_VERSION, _source_hash(func), func.__module__, func.__qualname__, args)
+
+def _encode(pattern):
+	''' Serialize a numeric MoirePattern, or return None. '''
+	if pattern._field is None:
+		return None
+	return json.dumps(pattern.to_dict(), separators=(',', ':')).encode()
+
+def _decode(blob):
+	from .pattern import MoirePattern
+	return MoirePattern.from_dict(json.loads(blob.decode()))
+
+def _lookup(conn, key):
+	row = conn.execute('SELECT value FROM patterns WHERE key = ?', (key,)).fetchone()
+	if row is None:
+		return None
+	conn.execute('UPDATE patterns SET accessed = ? WHERE key = ?', (time.time(), key))
+	return _decode(row[0])
+
+def _store(conn, key, blob):
+	with _transaction(conn):
+		old = conn.execute('SELECT size FROM patterns WHERE key = ?', (key,)).fetchone()
+		delta = len(blob) - (old[0] if old else 0)
+		conn.execute('INSERT OR REPLACE INTO patterns VALUES (?, ?, ?, ?)',
+			(key, blob, len(blob), time.time()))
+		conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'", (delta,))
+
+		(total,) = conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()
+		if total > _config['max_bytes']:
+			_evict(conn, total - _config['max_bytes'])
+
+def _evict(conn, nbytes):
+	''' Delete the least recently used entries, totalling at least nbytes. '''
+	freed = 0
+	doomed = []
+	for (key, size) in conn.execute('SELECT key, size FROM patterns ORDER BY accessed'):
+		if freed >= nbytes:
+			break
+		doomed.append((key,))
+		freed += size
+	conn.executemany('DELETE FROM patterns WHERE key = ?', doomed)
+	conn.execute("UPDATE meta SET value = value - ? WHERE name = 'total_size'", (freed,))
+
+@public
+def cached_constructor(func):
+	'''
+	Decorator for keyword-only MoirePattern constructors, which consults
+	the on-disk cache (if enabled) whenever no argument has free symbols.
+	'''
+	signature = inspect.signature(func)
+
+	@functools.wraps(func)
+	def wrapper(**kw):
+		conn = _connect()
+		if conn is None:
+			return func(**kw)
+
+		from sympy import S
+		bound = signature.bind(**kw)
+		bound.apply_defaults()
+		args = {k: S(v) for (k, v) in bound.arguments.items()}
+		if any(v.free_symbols for v in args.values()):
+			return func(**kw)
+
+		key = _canonical_key(func, args)
+		pattern = _lookup(conn, key)
+		if pattern is None:
+			pattern = func(**kw)
+			blob = _encode(pattern)
+			if blob is not None:
+				_store(conn, key, blob)
+		return pattern
+	return wrapper
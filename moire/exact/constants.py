@@ -9,15 +9,28 @@ __all__ = [
 	'HEX_INDEX',
 ]
 
+HEX_BETA  = 3
 
-from sympy import S
-from sympy import ImmutableMatrix
+# The matrix constants are built on first access (PEP 562),
+#  so that importing this module does not import sympy.
+def _symp_eye():  return [[1,0],[0,1]] # nyeah
+def _symp_zero(): return [[0,0],[0,0]]
+def _hex_index():
+	from sympy import S
+	return S('[[1,0],[1/2,1/2]]')
 
-SYMP_EYE  = ImmutableMatrix([[1,0],[0,1]]) # nyeah
-SYMP_ZERO = ImmutableMatrix([[0,0],[0,0]])
+_LAZY_MATRICES = {
+	'SYMP_EYE':  _symp_eye,
+	'SYMP_ZERO': _symp_zero,
+	'HEX_INDEX': _hex_index,
+}
 
-HEX_BETA  = 3
-HEX_INDEX = ImmutableMatrix(S('[[1,0],[1/2,1/2]]'))
+def __getattr__(name):
+	if name not in _LAZY_MATRICES:
+		raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+	from sympy import ImmutableMatrix
+	value = globals()[name] = ImmutableMatrix(_LAZY_MATRICES[name]())
+	return value
 
 # tsk tsk tsk python 2
 import sys
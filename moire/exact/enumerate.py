@@ -0,0 +1,156 @@
+from collections import namedtuple
+from fractions import Fraction
+from math import atan2, gcd, sqrt
+
+from .field import QuadraticMatrix, square_part
+from .hnf import supercell_hnf
+from moire.util import public
+
+__doc__ = '''
+Bulk enumeration of commensurate moire patterns.
+
+Unlike the constructors in build.py, nothing in here touches sympy;
+ the records produced are cheap, and a full MoirePattern can be
+ constructed from any one of them on demand.
+'''
+
+@public
+class RotationMoire(namedtuple('RotationMoire', 'β a b c angle c_matrix volume')):
+	'''
+	A commensurate rotation of prim_rotation_cell(β), with
+	 cos(angle) = a/c  and  sin(angle) = b sqrt(β)/c.
+
+	c_matrix is the HNF supercell matrix as nested tuples of ints,
+	 and volume is its determinant.  angle is in radians.
+	'''
+	__slots__ = ()
+
+	def moire_pattern(self):
+		''' Construct the corresponding MoirePattern. '''
+		from .build import prim_rotation_moire_abc
+		return prim_rotation_moire_abc(β=self.β, a=self.a, b=self.b, c=self.c)
+
+	def family_c_matrix(self, q, scale=1):
+		'''
+		HNF supercell matrix of the family member with cells  Q A  and  scale Q B
+		 (i.e. moire_pattern().visit_family(q), with B also scaled by a rational),
+		 computed without sympy.  q is a rational 2x2 matrix.
+		'''
+		q = _rational_matrix(q)
+		f = QuadraticMatrix(rotation_e_inverse(self.β, self.a, self.b, self.c))
+		# F' = Q F Q^-1 / scale
+		f = q * f * q.inv() * (1 / Fraction(scale))
+		return supercell_hnf(f.to_fractions())
+
+def rotation_e_inverse(β, a, b, c, k=1):
+	'''
+	E^-1 for prim_rotation_moire_abc, as Fractions.
+
+	More generally, for a rotation scaled by sqrt(k), where a*a + β*b*b == k*c*c
+	 (so that det(E) == k).
+	'''
+	return [
+		[Fraction(a, k*c), Fraction(-b, k*c)],
+		[Fraction(β*b, k*c), Fraction(a, k*c)],
+	]
+
+def primitive_rotation_triples(β, max_c):
+	'''
+	All primitive solutions of a*a + β*b*b == c*c with b > 0 and c <= max_c,
+	 in no particular order.  (a may be negative)
+
+	Uses the rational parametrization of the unit conic from the point (-1, 0);
+	 each coprime pair m, n produces  (m*m - β*n*n, 2*m*n, m*m + β*n*n) / g,
+	 where g divides 2β.
+	'''
+	limit = 2 * β * max_c
+	for n in range(1, int(sqrt(limit / β)) + 1):
+		for m in range(1, int(sqrt(limit - β*n*n)) + 1):
+			if gcd(m, n) != 1:
+				continue
+			(a, b, c) = (m*m - β*n*n, 2*m*n, m*m + β*n*n)
+			g = gcd(gcd(a, b), c)
+			(a, b, c) = (a // g, b // g, c // g)
+			if c <= max_c:
+				yield (a, b, c)
+
+@public
+def enumerate_rotation_moires(β, *, max_volume=None, max_c=None):
+	'''
+	Generate all commensurate rotations of prim_rotation_cell(β)
+	 (i.e. primitive solutions of a*a + β*b*b == c*c with b > 0)
+	 in order of increasing c, then increasing angle.
+
+	At least one of max_volume and max_c is required.  Yields RotationMoire.
+	'''
+	if max_volume is None and max_c is None:
+		raise ValueError('enumerate_rotation_moires: max_volume or max_c is required')
+
+	# The first row of C is already lcm(den(a/c), den(b/c)) == c,
+	#  so c is a lower bound on the volume.
+	bound = min(x for x in (max_volume, max_c) if x is not None)
+	angle = lambda a, b: atan2(b * sqrt(β), a)
+	triples = sorted(primitive_rotation_triples(β, bound),
+		key=lambda t: (t[2], angle(t[0], t[1])))
+
+	for (a, b, c) in triples:
+		cmat = supercell_hnf(rotation_e_inverse(β, a, b, c))
+		volume = cmat[0][0] * cmat[1][1]
+		if max_volume is not None and volume > max_volume:
+			continue
+		yield RotationMoire(β, a, b, c, angle(a, b), cmat, volume)
+
+def _rational_matrix(m):
+	return QuadraticMatrix([[Fraction(x) for x in row] for row in m])
+
+@public
+class SpecialReflectionMoire(namedtuple('SpecialReflectionMoire', 't β c_matrix volume')):
+	'''
+	A commensurate pattern of prim_special_reflection_cell(t) and its reflection,
+	 where the rational cosine t puts the cell in Q(sqrt(β)).
+
+	c_matrix is the HNF supercell matrix as nested tuples of ints,
+	 and volume is its determinant.
+	'''
+	__slots__ = ()
+
+	def moire_pattern(self, family=None):
+		''' Construct the corresponding MoirePattern. (see enumerate_special_reflection_moires) '''
+		from sympy import Matrix, Rational
+		from .build import prim_special_reflection_moire
+		pattern = prim_special_reflection_moire(t=Rational(self.t.numerator, self.t.denominator))
+		if family is not None:
+			(qa, qb) = (Matrix([[Rational(Fraction(x).numerator, Fraction(x).denominator) for x in row]
+				for row in q]) for q in family)
+			pattern = pattern.visit_family(qa, qb)
+		return pattern
+
+@public
+def enumerate_special_reflection_moires(*, max_denominator, family=None):
+	'''
+	Generate the patterns of prim_special_reflection_moire for every rational
+	 cosine 0 <= t < 1 with denominator <= max_denominator, by increasing
+	 denominator and then t.  Yields SpecialReflectionMoire.
+
+	The reflection maps prim_special_reflection_cell(t) onto itself with its
+	 rows swapped, so E is always [[0, 1], [1, 0]] and C is the identity;
+	 every such t is commensurate.  The supercell only becomes interesting
+	 for other members of the family:  ``family=(qa, qb)`` (rational 2x2
+	 matrices) gives the patterns of  visit_family(qa, qb)  instead.
+	 Since C does not depend on t, it is computed only once.
+	'''
+	if family is None:
+		cmat = ((1, 0), (0, 1))
+	else:
+		(qa, qb) = (_rational_matrix(q) for q in family)
+		# E' = qb E qa^-1, and E is its own inverse
+		swap = QuadraticMatrix([[0, 1], [1, 0]])
+		cmat = supercell_hnf((qa * swap * qb.inv()).to_fractions())
+	volume = cmat[0][0] * cmat[1][1]
+
+	for w in range(1, max_denominator + 1):
+		for u in range(0, w):
+			if gcd(u, w) != 1:
+				continue
+			# sqrt(1 - t*t) == sqrt(w*w - u*u) / w
+			yield SpecialReflectionMoire(Fraction(u, w), square_part(w*w - u*u)[1], cmat, volume)
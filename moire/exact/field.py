@@ -0,0 +1,312 @@
+from fractions import Fraction
+import functools
+import operator
+
+from moire.util import public
+
+__doc__ = '''
+Exact arithmetic in a quadratic field Q(sqrt(β)).
+
+MoirePattern uses these internally whenever its matrices are numeric,
+ so that sympy only gets involved at the API boundary.
+'''
+
+@public
+class QuadraticNumber:
+	'''
+	The exact number  r + s*sqrt(β)  for rational r, s and squarefree integer β.
+
+	Rationals may be combined with numbers of any β;  otherwise, mixing
+	 two different fields is an error.  β == 1 denotes a plain rational.
+	'''
+	__slots__ = ('r', 's', 'β')
+
+	def __init__(self, r, s=0, β=1):
+		(r, s) = (Fraction(r), Fraction(s))
+		if β == 1:
+			(r, s) = (r + s, Fraction(0))
+		(self.r, self.s, self.β) = (r, s, β)
+
+	@classmethod
+	def lift(klass, x):
+		''' Coerce an int or Fraction. '''
+		return x if isinstance(x, QuadraticNumber) else klass(x)
+
+	def _common_β(self, other):
+		if self.β == other.β or not other.s: return self.β
+		if not self.s: return other.β
+		raise ValueError('cannot mix Q(sqrt({})) and Q(sqrt({}))'.format(self.β, other.β))
+
+	def is_rational(self): return not self.s
+	def conjugate(self):   return QuadraticNumber(self.r, -self.s, self.β)
+	def norm(self):        return self.r * self.r - self.β * self.s * self.s
+
+	def inverse(self):
+		norm = self.norm()
+		if not norm:
+			raise ZeroDivisionError('QuadraticNumber division by zero')
+		return QuadraticNumber(self.r / norm, -self.s / norm, self.β)
+
+	def __add__(self, other):
+		other = QuadraticNumber.lift(other)
+		return QuadraticNumber(self.r + other.r, self.s + other.s, self._common_β(other))
+
+	def __mul__(self, other):
+		other = QuadraticNumber.lift(other)
+		β = self._common_β(other)
+		return QuadraticNumber(
+			self.r * other.r + β * self.s * other.s,
+			self.r * other.s + self.s * other.r, β)
+
+	def __neg__(self):                return QuadraticNumber(-self.r, -self.s, self.β)
+	def __sub__(self, other):         return self + (-QuadraticNumber.lift(other))
+	def __rsub__(self, other):        return QuadraticNumber.lift(other) - self
+	def __truediv__(self, other):     return self * QuadraticNumber.lift(other).inverse()
+	def __rtruediv__(self, other):    return QuadraticNumber.lift(other) * self.inverse()
+	__radd__ = __add__
+	__rmul__ = __mul__
+
+	def __pow__(self, n):
+		if n < 0:
+			return self.inverse() ** -n
+		out = QuadraticNumber(1, 0, self.β)
+		for _ in range(n):
+			out = out * self
+		return out
+
+	def __eq__(self, other):
+		if not isinstance(other, (QuadraticNumber, int, Fraction)):
+			return NotImplemented
+		other = QuadraticNumber.lift(other)
+		return self.r == other.r and self.s == other.s and (not self.s or self.β == other.β)
+
+	def __hash__(self):
+		return hash(self.r) if not self.s else hash((self.r, self.s, self.β))
+
+	def __bool__(self):  return bool(self.r or self.s)
+	def __float__(self): return float(self.r) + float(self.s) * float(self.β) ** 0.5
+
+	def __repr__(self):
+		if not self.s:
+			return 'QuadraticNumber({!s})'.format(self.r)
+		return 'QuadraticNumber({!s}, {!s}, β={})'.format(self.r, self.s, self.β)
+
+	def to_sympy(self):
+		from sympy import Rational, sqrt
+		rational = lambda x: Rational(x.numerator, x.denominator)
+		return rational(self.r) + rational(self.s) * sqrt(self.β)
+
+	@classmethod
+	def from_sympy(klass, x, β):
+		'''
+		Convert a numeric sympy expression that lies in Q(sqrt(β)).
+		Returns None for anything not obviously in the field.
+		'''
+		from sympy import S
+		if x.is_Rational:
+			return klass(Fraction(int(x.p), int(x.q)))
+		if x.is_Add or x.is_Mul:
+			terms = [klass.from_sympy(t, β) for t in x.args]
+			if None in terms:
+				return None
+			out = terms[0]
+			for t in terms[1:]:
+				out = out + t if x.is_Add else out * t
+			return out
+		if x.is_Pow:
+			(base, exp) = x.args
+			if base == β and abs(exp) == S.Half:
+				return klass(0, 1, β) ** int(2*exp)
+			if exp.is_Integer:
+				base = klass.from_sympy(base, β)
+				return None if base is None else base ** int(exp)
+		return None
+
+@public
+class QuadraticMatrix:
+	''' An immutable 2x2 matrix over Q(sqrt(β)). '''
+	__slots__ = ('_rows',)
+
+	def __init__(self, rows):
+		rows = tuple(tuple(QuadraticNumber.lift(x) for x in row) for row in rows)
+		if [len(row) for row in rows] != [2, 2]:
+			raise ValueError('QuadraticMatrix must be 2x2')
+		self._rows = rows
+
+	def __getitem__(self, ij):
+		(i, j) = ij
+		return self._rows[i][j]
+
+	def rows(self): return self._rows
+	def __iter__(self): return (x for row in self._rows for x in row)
+
+	def is_rational(self):
+		return all(x.is_rational() for x in self)
+
+	def det(self):
+		((a, b), (c, d)) = self._rows
+		return a * d - b * c
+
+	def inv(self):
+		((a, b), (c, d)) = self._rows
+		det = self.det()
+		if not det:
+			raise ZeroDivisionError('QuadraticMatrix is singular')
+		det = det.inverse()
+		return QuadraticMatrix([[d * det, -b * det], [-c * det, a * det]])
+
+	@property
+	def T(self):
+		((a, b), (c, d)) = self._rows
+		return QuadraticMatrix([[a, c], [b, d]])
+
+	def __mul__(self, other):
+		if not isinstance(other, QuadraticMatrix):
+			return QuadraticMatrix([[x * other for x in row] for row in self._rows])
+		(m, n) = (self._rows, other._rows)
+		return QuadraticMatrix([
+			[m[i][0] * n[0][j] + m[i][1] * n[1][j] for j in range(2)]
+			for i in range(2)
+		])
+
+	def __rmul__(self, scalar):
+		return self * scalar
+
+	def __eq__(self, other):
+		if not isinstance(other, QuadraticMatrix):
+			return NotImplemented
+		return self._rows == other._rows
+
+	def __hash__(self):
+		return hash(self._rows)
+
+	def __repr__(self):
+		return 'QuadraticMatrix({!r})'.format([list(row) for row in self._rows])
+
+	def to_fractions(self):
+		''' The entries as nested lists of Fraction.  (requires a rational matrix) '''
+		if not self.is_rational():
+			raise ValueError('matrix is not rational: {!r}'.format(self))
+		return [[x.r for x in row] for row in self._rows]
+
+	def to_sympy(self):
+		from sympy import ImmutableMatrix
+		return ImmutableMatrix([[x.to_sympy() for x in row] for row in self._rows])
+
+	@classmethod
+	def from_sympy(klass, m, β):
+		''' Convert a numeric sympy matrix, or return None. '''
+		rows = [[QuadraticNumber.from_sympy(m[i,j], β) for j in range(2)] for i in range(2)]
+		if any(x is None for row in rows for x in row):
+			return None
+		return klass(rows)
+
+def field_radicand(mats):
+	'''
+	Find the β such that every entry of the given sympy matrices lies in Q(sqrt(β)).
+
+	Returns 1 if all entries are rational, and None if the entries have free
+	 symbols or do not all share a single quadratic field.
+	'''
+	from sympy import S, Integer, Pow
+	radicands = set()
+	for m in mats:
+		if m.free_symbols:
+			return None
+		for x in m:
+			for p in x.atoms(Pow):
+				if abs(p.exp) != S.Half or not isinstance(p.base, Integer):
+					return None
+				radicands.add(int(p.base))
+	if len(radicands) > 1:
+		return None
+	return radicands.pop() if radicands else 1
+
+def matrices_from_sympy(mats):
+	'''
+	Convert several sympy matrices into QuadraticMatrix over one common field.
+	Returns None if that is not possible.
+	'''
+	β = field_radicand(mats)
+	if β is None:
+		return None
+	out = [QuadraticMatrix.from_sympy(m, β) for m in mats]
+	return None if None in out else out
+
+# Below this, trial division is quick enough that sympy needn't be imported.
+_TRIAL_DIVISION_LIMIT = 2**32
+
+@functools.lru_cache(maxsize=1024)
+def square_part(n):
+	''' Write a positive integer as  s*s*f  with f squarefree.  Returns (s, f). '''
+	if n >= _TRIAL_DIVISION_LIMIT:
+		from sympy.ntheory import factorint
+		factors = factorint(n).items()
+	else:
+		factors = _trial_division(n)
+	(s, f) = (1, 1)
+	for (p, e) in factors:
+		s *= p ** (e // 2)
+		f *= p ** (e % 2)
+	return (s, f)
+
+def _trial_division(n):
+	''' Prime factorization of n as (prime, exponent) pairs. '''
+	p = 2
+	while p * p <= n:
+		e = 0
+		while n % p == 0:
+			(n, e) = (n // p, e + 1)
+		if e:
+			yield (p, e)
+		p += 1 if p == 2 else 2
+	if n > 1:
+		yield (n, 1)
+
+def rational_sqrt(x):
+	''' The square root of a nonnegative rational, as a QuadraticNumber. '''
+	x = QuadraticNumber.lift(x)
+	if not x.is_rational() or x.r < 0:
+		raise ValueError('not a nonnegative rational: {!r}'.format(x))
+	if not x.r:
+		return x
+	(n, d) = (x.r.numerator, x.r.denominator)
+	(s, f) = square_part(n * d)
+	return QuadraticNumber(0, Fraction(s, d), f)
+
+def compile_expr(expr):
+	'''
+	Turn a sympy expression made of symbols, rationals, sums, products,
+	 integer powers and square roots into a python function that evaluates
+	 it exactly.  The function takes a dict from sympy Symbol to
+	 QuadraticNumber, and returns a QuadraticNumber.
+
+	Returns None for anything else (e.g. trig functions).
+	The compiled function raises ValueError if a square root leaves the field.
+	'''
+	if expr.is_Symbol:
+		return lambda env: env[expr]
+	if expr.is_Rational:
+		const = QuadraticNumber(Fraction(int(expr.p), int(expr.q)))
+		return lambda env: const
+	if expr.is_Add or expr.is_Mul:
+		terms = [compile_expr(t) for t in expr.args]
+		if None in terms:
+			return None
+		(first, *rest) = terms
+		op = operator.add if expr.is_Add else operator.mul
+		def func(env):
+			out = first(env)
+			for term in rest:
+				out = op(out, term(env))
+			return out
+		return func
+	if expr.is_Pow:
+		(base, exp) = expr.args
+		base = compile_expr(base)
+		if base is not None and exp.is_Rational and exp.q in (1, 2):
+			p = int(exp.p)
+			if exp.q == 1:
+				return lambda env: base(env) ** p
+			return lambda env: rational_sqrt(base(env)) ** p
+	return None
@@ -0,0 +1,183 @@
+from fractions import Fraction
+from math import gcd
+import math
+import operator
+
+from moire.util import public
+
+__doc__ = '''
+Exact integer arithmetic for supercell matrices.
+
+Everything in here works on plain python ints and Fractions;
+ 2x2 matrices are nested sequences indexed as m[row][col].
+'''
+
+def _lcm(a, b):
+	return a * b // gcd(a, b)
+
+def _hnf_reduce(m):
+	''' Reduce a lower triangular basis (with positive diagonal) into HNF. '''
+	((c00, _), (c10, c11)) = m
+	return ((c00, 0), (c10 % c00, c11))
+
+def _lower_product(m, n):
+	''' Product of two lower triangular 2x2 matrices. '''
+	((m00, _), (m10, m11)) = m
+	((n00, _), (n10, n11)) = n
+	return ((m00 * n00, 0), (m10 * n00 + m11 * n10, m11 * n11))
+
+@public
+def congruence_hnf(n0, n1, d):
+	'''
+	HNF basis of the lattice of integer rows (x, y) satisfying
+	 x * n0 + y * n1 == 0  (mod d).
+
+	The basis is returned as ((h00, 0), (h10, h11)).
+	'''
+	g = gcd(gcd(n0, n1), d)
+	(n0, n1, d) = (n0 // g, n1 // g, d // g)
+
+	# (x, 0) is a solution iff (d/g0) divides x
+	g0 = gcd(n0, d)
+	h00 = d // g0
+
+	# (x, y) is solvable iff g0 divides y; and then x is unique modulo h00.
+	# (h00 == 1 leaves nothing to solve for, and the inverse would not exist)
+	if h00 == 1:
+		return ((1, 0), (0, g0))
+	h10 = -n1 * pow(n0 // g0, -1, h00) % h00
+	return ((h00, 0), (h10, g0))
+
+@public
+def supercell_hnf(f):
+	'''
+	Locate the HNF matrix C such that C * F is integral.
+
+	``f`` is a 2x2 matrix of rationals (anything accepted by ``Fraction``);
+	 for a MoirePattern, F is E^-1.  C is returned as ((c00, 0), (c10, c11)).
+
+	Each column of F contributes one linear congruence on the rows of C;
+	 these are solved one after the other by restricting the second to the
+	 solution lattice of the first.
+	'''
+	f = [[Fraction(x) for x in row] for row in f]
+	basis = ((1, 0), (0, 1))
+	for col in range(2):
+		d = _lcm(f[0][col].denominator, f[1][col].denominator)
+		# numerators of the column over its common denominator,
+		#  expressed in the current basis
+		n = [int(f[row][col] * d) for row in range(2)]
+		n = [sum(basis[i][k] * n[k] for k in range(2)) for i in range(2)]
+		basis = _lower_product(congruence_hnf(n[0], n[1], d), basis)
+	return _hnf_reduce(basis)
+
+def _exact_int(x, who):
+	''' x as a python int, or ValueError if it is not an integer (floats included). '''
+	if isinstance(x, Fraction) and x.denominator == 1:
+		return x.numerator
+	try:
+		return operator.index(x)
+	except TypeError:
+		raise ValueError('{}: not an integer: {!r}'.format(who, x)) from None
+
+def _round_div(n, d):
+	''' Exact round(n/d) for integers (d > 0), with halves rounded up. '''
+	return (2 * n + d) // (2 * d)
+
+@public
+def lagrange_reduce(m, metric=None):
+	'''
+	Lagrange-Gauss reduction of the rows of an integer 2x2 matrix.
+	 (anything but exact integers, floats included, is a ValueError)
+
+	Returns a matrix with the same row lattice and the same determinant
+	 whose rows are as short as possible, as nested tuples.  Lengths are
+	 measured with the rational Gram matrix ``metric`` (default: identity).
+	'''
+	if metric is None:
+		metric = ((1, 0), (0, 1))
+	g = [[Fraction(x) for x in row] for row in metric]
+	dot = lambda u, v: sum(u[i] * g[i][j] * v[j] for i in range(2) for j in range(2))
+	det = lambda u, v: u[0] * v[1] - u[1] * v[0]
+
+	(u, v) = ([_exact_int(x, 'lagrange_reduce') for x in row] for row in m)
+	sign = det(u, v)
+	if not sign:
+		raise ValueError('lagrange_reduce: singular matrix')
+
+	if dot(u, u) > dot(v, v):
+		(u, v) = (v, u)
+	while True:
+		uu = dot(u, u)
+		mu = math.floor(dot(u, v) / uu + Fraction(1, 2))
+		v = [v[i] - mu * u[i] for i in range(2)]
+		if dot(v, v) >= uu:
+			break
+		(u, v) = (v, u)
+
+	# swaps flip the orientation; negating a row flips it back
+	if (det(u, v) > 0) != (sign > 0):
+		v = [-x for x in v]
+	return (tuple(u), tuple(v))
+
+# entries beyond this could overflow int64 while computing squared norms
+_BATCH_LIMIT = 2**28
+
+@public
+def lagrange_reduce_batch(mats):
+	'''
+	Vectorized lagrange_reduce (identity metric) for an integer array of
+	 shape (N, 2, 2).  Returns a new int64 array of the same shape.
+	'''
+	import numpy as np
+	mats = _batch_array(mats)
+	if not mats.size:
+		return np.zeros((0, 2, 2), dtype=np.int64)
+	if mats.dtype == object:
+		return np.array([lagrange_reduce(m) for m in mats], dtype=object).reshape(mats.shape)
+
+	u = mats[:, 0].copy()
+	v = mats[:, 1].copy()
+	det = lambda u, v: u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+	sign = det(u, v)
+	if (sign == 0).any():
+		raise ValueError('lagrange_reduce_batch: singular matrix')
+
+	norm = lambda x: (x * x).sum(axis=1)
+	swap = norm(u) > norm(v)
+	(u[swap], v[swap]) = (v[swap], u[swap].copy())
+
+	active = np.arange(len(mats))
+	while len(active):
+		(ua, va) = (u[active], v[active])
+		uu = norm(ua)
+		mu = _round_div((ua * va).sum(axis=1), uu)
+		va = va - mu[:, None] * ua
+		done = norm(va) >= uu
+
+		# unfinished rows swap, and go around again
+		u[active] = np.where(done[:, None], ua, va)
+		v[active] = np.where(done[:, None], va, ua)
+		active = active[~done]
+
+	flip = (det(u, v) > 0) != (sign > 0)
+	v[flip] *= -1
+	return np.stack([u, v], axis=1)
+
+def _batch_array(x):
+	'''
+	Convert integer input to an int64 array, or to an array of python ints
+	 if it is too large to be safely handled in int64.  Non-integer input
+	 (e.g. floats) is a ValueError.
+	'''
+	import numpy as np
+	x = np.asarray(x)
+	if not x.size:
+		return x.astype(np.int64)
+	if x.dtype.kind not in 'iu':
+		if x.dtype != object:
+			raise ValueError('expected an integer array, got dtype {}'.format(x.dtype))
+		x = np.vectorize(lambda v: _exact_int(v, 'lagrange_reduce_batch'), otypes=[object])(x)
+	if x.size and np.abs(x).max() >= _BATCH_LIMIT:
+		return x.astype(object)
+	return x.astype(np.int64)
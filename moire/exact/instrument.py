@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+import functools
+import time
+
+from moire.util import public
+
+__doc__ = '''
+Opt-in timing counters for the stages of MoirePattern construction.
+
+The library is instrumented with ``stage(name)`` blocks and ``timed(name)``
+ decorators.  While profiling is disabled (the default) these cost one
+ global lookup and a branch.  Once enabled, every stage records its
+ number of calls, cumulative wall time, and a count of items processed
+ (e.g. candidate rows tested by the brute force search for C).
+
+	with profiling():
+		run_my_sweep()
+	print(summary())
+'''
+
+_ENABLED = False
+_stats = {} # name -> [calls, seconds, items]
+
+class _Stage:
+	__slots__ = ('name', 'start')
+	def __init__(self, name):
+		self.name = name
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+	def __exit__(self, *exc):
+		record(self.name, seconds=time.perf_counter() - self.start)
+		return False
+
+class _NullStage:
+	__slots__ = ()
+	def __enter__(self): return self
+	def __exit__(self, *exc): return False
+
+_NULL_STAGE = _NullStage()
+
+def stage(name):
+	''' Context manager that times a block under ``name``. '''
+	return _Stage(name) if _ENABLED else _NULL_STAGE
+
+def timed(name):
+	''' Decorator that times every call to a function under ``name``. '''
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kw):
+			if not _ENABLED:
+				return func(*args, **kw)
+			with _Stage(name):
+				return func(*args, **kw)
+		return wrapper
+	return decorator
+
+def record(name, calls=1, seconds=0.0, items=0):
+	''' Add to the counters for ``name`` (if enabled). '''
+	if not _ENABLED:
+		return
+	entry = _stats.setdefault(name, [0, 0.0, 0])
+	entry[0] += calls
+	entry[1] += seconds
+	entry[2] += items
+
+def count(name, items=1):
+	''' Count items processed by a stage, without timing anything. '''
+	record(name, calls=0, items=items)
+
+@public
+def enable_profiling(enabled=True):
+	global _ENABLED
+	_ENABLED = enabled
+
+@public
+def profiling_enabled():
+	return _ENABLED
+
+@public
+@contextmanager
+def profiling(reset=True):
+	'''
+	Enable profiling for the duration of a block.
+	Yields the live statistics dict.  (see stats())
+	'''
+	old = _ENABLED
+	if reset:
+		reset_stats()
+	enable_profiling()
+	try:
+		yield _stats
+	finally:
+		enable_profiling(old)
+
+@public
+def stats():
+	''' A copy of the counters, as {name: (calls, seconds, items)}. '''
+	return {name: tuple(v) for (name, v) in _stats.items()}
+
+@public
+def reset_stats():
+	_stats.clear()
+
+@public
+def merge_stats(other):
+	''' Add counters produced elsewhere (e.g. by stats() in another process). '''
+	for (name, (calls, seconds, items)) in other.items():
+		entry = _stats.setdefault(name, [0, 0.0, 0])
+		entry[0] += calls
+		entry[1] += seconds
+		entry[2] += items
+
+@public
+def summary():
+	''' A table of the counters, slowest first. '''
+	lines = ['{:<36} {:>10} {:>12} {:>12}'.format('stage', 'calls', 'seconds', 'items')]
+	for (name, (calls, seconds, items)) in sorted(_stats.items(), key=lambda x: -x[1][1]):
+		lines.append('{:<36} {:>10} {:>12.4f} {:>12}'.format(name, calls, seconds, items))
+	return '\n'.join(lines)
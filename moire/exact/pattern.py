@@ -1,12 +1,15 @@
-from sympy import simplify
-from sympy import ImmutableMatrix, Matrix
-from sympy import lcm
-
+import functools
 import itertools
 
-from .constants import SYMP_EYE, SYMP_ZERO
+from .hnf import supercell_hnf
+from .field import QuadraticNumber, QuadraticMatrix, matrices_from_sympy, compile_expr
+from .serialize import pattern_to_dict, pattern_from_dict
+from .instrument import stage, timed, count
 from moire.util import public
 
+# NOTE: sympy is only imported inside the methods that need it, so that
+#       numeric patterns (e.g. from from_dict) can be used without it.
+
 # Used to provide "keyword-only" args in a python-2 compatible manner.
 # It stands as a canary argument in some functions to ensure that they
 #  do not receive more positional arguments than expected.
@@ -27,51 +30,168 @@ class MoirePattern:
 			raise RuntimeError('Do not initialize directly. Please use the named constructors instead.')
 
 	@classmethod
-	def from_cells(klass, a, b):
+	def from_cells(klass, a, b, use_kw_args=MAGIC, validate=True):
 		''' Construct from two cell matrices (A and B). '''
-		return klass.from_abe(a, b, b*a.inv())
+		if use_kw_args is not MAGIC:
+			raise ValueError('Please use kw args only after the required args')
+		return klass.from_abe(a, b, b*a.inv(), validate=validate)
 
 	@classmethod
-	def from_opers(klass, a1, use_kw_args=MAGIC, a2=None, scale=1, rows=SYMP_EYE, cart=SYMP_EYE):
+	def from_opers(klass, a1, use_kw_args=MAGIC, a2=None, scale=1, rows=None, cart=None, validate=True):
 		'''
 		Construct from one cell matrix A and two transformations.
 
 		The second cell matrix is produced by applying one transformation to
 		each side;  B = M1 * A * M2^T.  Effectively, M1 takes a linear combination
 		of the rows, while M2 operates on each row as a cartesian vector.
+		(rows and cart default to the identity)
 		'''
+		from .constants import SYMP_EYE
 		if use_kw_args is not MAGIC:
 			raise ValueError('Please use kw args only after a1')
-		return klass.from_cells(a1, scale * rows * (a2 or a1) * cart.T)
+		if rows is None: rows = SYMP_EYE
+		if cart is None: cart = SYMP_EYE
+		return klass.from_cells(a1, scale * rows * (a2 or a1) * cart.T, validate=validate)
 
 	@classmethod
-	def from_abe(klass, a, b, e, use_kw_args=MAGIC, c=None):
+	@timed('from_abe')
+	def from_abe(klass, a, b, e, use_kw_args=MAGIC, c=None, validate=True):
 		'''
 		Primary constructor.
 
 		Takes both cells A and B and the rational matrix  E = B A^-1.
 		Its raison d'etre is to allow E to be parametrized in terms of more
-		meaningful variables. It also validates the relation between A, B, and E,
-		and computes the supercell matrix once enough variables have been substituted.
+		meaningful variables. It also validates the relation between A, B, and E.
+		The supercell matrix is computed on first use, once enough variables
+		have been substituted.
+
+		When every entry is a number in a single field Q(sqrt(β)), the matrices
+		are validated and canonicalized with exact arithmetic in that field rather
+		than with sympy.simplify.  validate=False skips the validation entirely,
+		for input that is already known to be consistent.
 		'''
+		from sympy import ImmutableMatrix, simplify
+		from .constants import SYMP_ZERO
 		if use_kw_args is not MAGIC:
 			raise ValueError('Please use kw args only after the required args')
+		(a, b, e) = (ImmutableMatrix(x) for x in (a,b,e))
+
+		qmats = matrices_from_sympy((a,b,e))
+		if qmats is not None:
+			return klass._from_field(*qmats, c=c, validate=validate)
+
 		self = klass(dont_use=MAGIC)
-		assert simplify(e * a - b) == SYMP_ZERO, "{} \n VERSUS \n {}".format(e*a, b)
-		(self._a, self._b, self._e) = (ImmutableMatrix(simplify(x)) for x in (a,b,e))
-		self._c = c
+		self._field = None
+		if validate:
+			with stage('from_abe.validate'), stage('simplify'):
+				assert simplify(e * a - b) == SYMP_ZERO, "{} \n VERSUS \n {}".format(e*a, b)
+		with stage('simplify'):
+			(self._a, self._b, self._e) = tuple(ImmutableMatrix(simplify(x)) for x in (a,b,e))
+		if c is not None:
+			self._c = c
+		return self
 
-		if self._c is None and not self._e.free_symbols:
-			assert all(x.is_rational for x in self._e), str(self._e)
-			self._c = self._bruteforce_c(e)
+	@classmethod
+	def _from_field(klass, qa, qb, qe, use_kw_args=MAGIC, c=None, validate=True):
+		'''
+		Construct from three QuadraticMatrix objects, without touching sympy.
+		c may be given as any 2x2 integer matrix.
+		'''
+		if use_kw_args is not MAGIC:
+			raise ValueError('Please use kw args only after the required args')
+		if validate:
+			with stage('from_abe.validate'):
+				assert qe * qa == qb, "{} \n VERSUS \n {}".format(qe * qa, qb)
+		self = klass(dont_use=MAGIC)
+		self._field = (qa, qb, qe)
+		if c is not None:
+			self._c_hnf = tuple(tuple(int(x) for x in row) for row in _rows(c))
 		return self
 
+	# NOTE: Everything derived from A, B and E is computed on first access
+	#       and memoized on the instance (patterns are immutable), so that
+	#       e.g. a pattern that only exists to be passed to visit_family
+	#       never pays for C.
+
+	# For numeric patterns, the sympy matrices are only produced on demand.
+	def _sympy_from_field(index):
+		return functools.cached_property(lambda self: self._field[index].to_sympy())
+	_a = _sympy_from_field(0)
+	_b = _sympy_from_field(1)
+	_e = _sympy_from_field(2)
+	del _sympy_from_field
+
+	@functools.cached_property
+	def _c_hnf(self):
+		''' C as nested tuples of ints.  (numeric patterns only) '''
+		qe = self._field[2]
+		assert qe.is_rational(), repr(qe)
+		with stage('supercell_hnf'):
+			c = supercell_hnf(self._qe_inv.to_fractions())
+		return tuple(tuple(int(x) for x in row) for row in c)
+
+	@functools.cached_property
+	def _c(self):
+		''' C as a sympy matrix, or None while E has free variables. '''
+		from sympy import ImmutableMatrix
+		if self._field is not None:
+			return ImmutableMatrix(self._c_hnf)
+		if self._e.free_symbols:
+			return None
+		assert all(x.is_rational for x in self._e), str(self._e)
+		return self._analytic_c(self._e)
+
+	@functools.cached_property
+	def _qe_inv(self):
+		return self._field[2].inv()
+
+	@functools.cached_property
+	def _e_inv(self):
+		if self._field is not None:
+			return self._qe_inv.to_sympy()
+		return self._e.inv()
+
+	@functools.cached_property
+	def _a_inv(self):
+		if self._field is not None:
+			return self._field[0].inv().to_sympy()
+		return self._a.inv()
+
+	@functools.cached_property
+	def _swapped(self):
+		if self._field is not None:
+			(qa, qb, qe) = self._field
+			other = self._from_field(qb, qa, self._qe_inv, validate=False)
+			other._qe_inv = qe
+		else:
+			other = self.from_abe(self._b, self._a, self._e_inv, validate=False)
+		other._swapped = self
+		return other
+
 	@staticmethod
+	@timed('analytic_c')
+	def _analytic_c(e):
+		'''
+		Locate HNF matrix C such that C * E^-1 is integral,
+		using exact integer arithmetic on the rational entries of E.
+		'''
+		from fractions import Fraction
+		from sympy import ImmutableMatrix
+		e = e.inv()
+		f = [[Fraction(int(x.p), int(x.q)) for x in e.row(i)] for i in range(2)]
+		return ImmutableMatrix(supercell_hnf(f))
+
+	@staticmethod
+	@timed('bruteforce_c')
 	def _bruteforce_c(e):
 		'''
 		Locate HNF matrix C such that C * E^-1 is integral
 		in a slightly dumb manner.
+
+		(Kept around as a reference for _analytic_c, which is what
+		 actually gets used.)
 		'''
+		from sympy import ImmutableMatrix, Matrix, lcm
 		e = e.inv()
 		is_row_ok = lambda row: all(x.is_integer for x in row * e)
 		denominator = lambda rat: rat.as_numer_denom()[1]
@@ -86,13 +206,14 @@ class MoirePattern:
 		for c11 in itertools.count(1):
 			for c10 in range(c00):
 				if is_row_ok(Matrix([[c10,c11]])):
+					count('bruteforce_c', int((c11 - 1) * c00 + c10 + 1)) # candidate rows tested
 					return ImmutableMatrix([[c00,0], [c10,c11]])
 
 	def swap_cells(self):
-		''' Flip the roles of A and B. '''
-		# NOTE: C is thrown away and recomputed due to the
+		''' Flip the roles of A and B.  (the result is memoized) '''
+		# NOTE: C of the swapped pattern is not simply D, due to the
 		#       invariant that we only store the HNF cell.
-		return self.from_abe(self._b, self._a, self._e.inv())
+		return self._swapped
 
 	def _checked_c(self):
 		if not self._c:
@@ -104,7 +225,7 @@ class MoirePattern:
 	def a_matrix(self): return self._a
 	def b_matrix(self): return self._b
 	def e_matrix(self): return self._e
-	def m_matrix(self): return (self._a.inv() * self._b).T
+	def m_matrix(self): return (self._a_inv * self._b).T
 	def cells(self):    return (self._a, self._b)
 	c_matrix = _checked_c
 	c_matrix_hnf = c_matrix
@@ -127,14 +248,25 @@ class MoirePattern:
 		visit_family(self, qa, qb):  multiples each cell by a different matrix.
 		                             (use None for an identity transform)
 		'''
+		from sympy import ImmutableMatrix
+		from .constants import SYMP_EYE
 		if qb is self._NOT_SPECIFIED: qb = qa
 		if qa is None: qa = SYMP_EYE
 		if qb is None: qb = SYMP_EYE
+
+		if self._field is not None:
+			qmats = matrices_from_sympy((ImmutableMatrix(qa), ImmutableMatrix(qb)))
+			if qmats is not None:
+				((fqa, fqb), (fa, fb, fe)) = (qmats, self._field)
+				return type(self)._from_field(fqa * fa, fqb * fb, fqb * fe * fqa.inv(),
+					validate=False)
+
 		return type(self).from_abe(
 			a=qa * self._a,
 			b=qb * self._b,
 			e=qb * self._e * qa.inv(),
 			c=None, # invalidated!
+			validate=False, # holds by construction
 		)
 
 	def d_matrix(self):
@@ -142,8 +274,13 @@ class MoirePattern:
 		Get the (integer) matrix D which describes the commensurate cell
 		in terms of B;  CA == DB.  This matrix is not necessarily in HNF.
 		'''
-		return self._checked_c() * self._e.inv()
+		if self._field is not None:
+			self._checked_c()
+			d = QuadraticMatrix(self._c_hnf) * self._qe_inv
+			return d.to_sympy()
+		return self._checked_c() * self._e_inv
 
+	@timed('d_matrix_hnf')
 	def d_matrix_hnf(self):
 		'''
 		Get the HNF form of the matrix D which describes the commensurate cell
@@ -166,6 +303,7 @@ class MoirePattern:
 		to A.  (i.e. is this a valid replacement for C?)
 		E must be fully determined.
 		'''
+		from sympy import ImmutableMatrix
 		mat = ImmutableMatrix(mat)
 		assert all(x.is_integer for x in mat)
 		# two supercell matrices are equivalent if they are related
@@ -173,6 +311,18 @@ class MoirePattern:
 		prod = self._checked_c() * mat.inv()
 		return all(x.is_integer for x in prod) and abs(prod.det()) == 1
 
+	def valid_primitive_supercells(self, mats):
+		'''
+		Batch version of is_valid_primitive_supercell.
+
+		Takes an integer array of shape (N, 2, 2) and returns a boolean
+		array of shape (N,), using exact integer arithmetic in numpy.
+		'''
+		from .batch import valid_supercell_mask
+		if self._field is not None:
+			return valid_supercell_mask(self._c_hnf, mats)
+		return valid_supercell_mask(self._checked_c().tolist(), mats)
+
 	def relative_supercell_volume(self):
 		''' The supercell volume in units of the volume of A. '''
 		v = self._checked_c().det()
@@ -181,10 +331,90 @@ class MoirePattern:
 
 	def subs(self, *args, **kw):
 		''' Sympy symbol substitution '''
+		if self._field is not None:
+			return self # nothing to substitute
 		# hack to make iterable of (var, value) reiterable:
 		d = dict(*args, **kw)
+		if self._compiled is not None:
+			out = self._compiled_subs(d)
+			if out is not None:
+				return out
 		(a,b,e) = (m.subs(d) for m in (self._a, self._b, self._e))
 		return type(self).from_abe(a,b,e,c=self._c)
 
+	_compiled = None
+	def compile(self):
+		'''
+		Prepare a symbolic pattern for many calls to subs.
+
+		A, B and E are turned into python functions that evaluate them exactly.
+		Afterwards, a subs() that gives a rational value to every free symbol
+		 skips sympy entirely, and skips validation (E A == B was already
+		 checked symbolically when this pattern was constructed).  Any other
+		 subs() takes the usual path.  Returns self.
+
+		(the compiled functions are not pickled along with the pattern)
+		'''
+		if self._field is None and self._compiled is None:
+			funcs = tuple(tuple(tuple(compile_expr(m[i,j]) for j in range(2)) for i in range(2))
+				for m in (self._a, self._b, self._e))
+			if any(f is None for m in funcs for row in m for f in row):
+				return self # not an error; subs simply stays slow
+			symbols = frozenset().union(*(m.free_symbols for m in (self._a, self._b, self._e)))
+			self._compiled = (symbols, funcs)
+		return self
+
+	def __getstate__(self):
+		# compiled functions are closures, which can't be pickled;
+		#  an unpickled pattern simply needs to be compiled again.
+		state = dict(self.__dict__)
+		state.pop('_compiled', None)
+		return state
+
+	@timed('compiled_subs')
+	def _compiled_subs(self, d):
+		''' subs() for a compiled pattern, or None if the fast path does not apply. '''
+		from sympy import Symbol
+		(symbols, funcs) = self._compiled
+		env = {}
+		for (k, v) in d.items():
+			k = Symbol(k) if isinstance(k, str) else k
+			v = _to_quadratic(v)
+			if v is None:
+				return None
+			env[k] = v
+		if not symbols <= env.keys():
+			return None
+		try:
+			(qa, qb, qe) = (QuadraticMatrix([[f(env) for f in row] for row in m]) for m in funcs)
+		except (ValueError, ZeroDivisionError):
+			return None # let sympy deal with it
+		return type(self)._from_field(qa, qb, qe, c=self._c, validate=False)
+
+	def to_dict(self):
+		'''
+		Plain JSON-compatible data describing a numeric pattern.
+		(see moire.exact.serialize for the format)
+		'''
+		return pattern_to_dict(self)
+
+	@classmethod
+	def from_dict(klass, d):
+		''' Inverse of to_dict.  The data is trusted, and not validated. '''
+		return pattern_from_dict(klass, d)
+
 	def __repr__(self):
 		return 'MoirePattern.from_abe(\n\ta = {},\n\tb = {},\n\te = {})'.format(self._a, self._b, self._e)
+
+def _to_quadratic(x):
+	''' Coerce a rational substitution value, or return None. '''
+	from fractions import Fraction
+	if isinstance(x, (int, Fraction)):
+		return QuadraticNumber(x)
+	if getattr(x, 'is_Rational', False):
+		return QuadraticNumber(Fraction(int(x.p), int(x.q)))
+	return None
+
+def _rows(m):
+	''' Rows of a nested sequence or a sympy matrix. '''
+	return m.tolist() if hasattr(m, 'tolist') else m
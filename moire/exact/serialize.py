@@ -0,0 +1,63 @@
+from fractions import Fraction
+import json
+
+from moire.util import public
+
+__doc__ = '''
+Compact serialization of numeric MoirePatterns.
+
+MoirePattern.to_dict() produces plain JSON-compatible data:
+
+	{'β': 3, 'a': [[x, x], [x, x]], 'b': ..., 'e': ..., 'c': [[c00, 0], [c10, c11]]}
+
+where each entry x of A, B and E is either [n, d] for the rational n/d,
+ or [n, d, sn, sd] for n/d + (sn/sd)*sqrt(β).  The bulk format is simply
+ one such dict per line (JSON lines).
+'''
+
+def _number_to_list(x):
+	out = [x.r.numerator, x.r.denominator]
+	if x.s:
+		out += [x.s.numerator, x.s.denominator]
+	return out
+
+def _number_from_list(x, β):
+	from .field import QuadraticNumber
+	if len(x) == 2:
+		return QuadraticNumber(Fraction(x[0], x[1]))
+	return QuadraticNumber(Fraction(x[0], x[1]), Fraction(x[2], x[3]), β)
+
+def pattern_to_dict(pattern):
+	if pattern._field is None:
+		raise ValueError('only numeric MoirePatterns can be serialized')
+	matrix = lambda m: [[_number_to_list(x) for x in row] for row in m.rows()]
+	(qa, qb, qe) = pattern._field
+	β = next((x.β for m in pattern._field for x in m if x.s), 1)
+	return {
+		'β': β,
+		'a': matrix(qa),
+		'b': matrix(qb),
+		'e': matrix(qe),
+		'c': [list(row) for row in pattern._c_hnf],
+	}
+
+def pattern_from_dict(klass, d):
+	from .field import QuadraticMatrix
+	matrix = lambda m: QuadraticMatrix([[_number_from_list(x, d['β']) for x in row] for row in m])
+	(qa, qb, qe) = (matrix(d[k]) for k in 'abe')
+	return klass._from_field(qa, qb, qe, c=d.get('c'), validate=False)
+
+@public
+def dump_patterns(patterns, file):
+	''' Write numeric MoirePatterns to a text file, one JSON object per line. '''
+	for pattern in patterns:
+		file.write(json.dumps(pattern.to_dict(), separators=(',', ':')))
+		file.write('\n')
+
+@public
+def load_patterns(file):
+	''' Lazily read MoirePatterns written by dump_patterns. '''
+	from .pattern import MoirePattern
+	for line in file:
+		if line.strip():
+			yield MoirePattern.from_dict(json.loads(line))
@@ -0,0 +1,131 @@
+from collections import namedtuple
+
+import numpy as np
+
+from moire.util import public
+
+__doc__ = '''
+Streaming generation of the lattice sites in a commensurate supercell.
+
+The sites of layer 1 are the cosets of the integer lattice modulo the rows
+ of C;  for C in HNF ((c00, 0), (c10, c11)), these are represented by the
+ rows (i, j) with  0 <= i < c00  and  0 <= j < c11.  Layer 2 is the same
+ with D in place of C.  Fractional coordinates in the supercell are computed
+ exactly as integers over det(C), and only converted to floats at the end.
+
+Sites are produced in chunks of NumPy arrays, so that structures with
+ millions of sites can be written out without holding them in memory.
+'''
+
+DEFAULT_CHUNK_SIZE = 2**16
+# Below this volume, products of two residues mod the volume fit in int64.
+_INT64_MAX_VOLUME = 2**31
+
+@public
+class SiteChunk(namedtuple('SiteChunk', 'layer index frac cart')):
+	'''
+	A block of sites from one layer.  ``index`` (N, 2) holds the integer
+	 coordinates of each site in terms of the layer's cell, ``frac`` (N, 2)
+	 the fractional coordinates in the supercell (in [0, 1)), and ``cart``
+	 (N, 2) the cartesian coordinates.
+	'''
+	__slots__ = ()
+
+def _int_matrix(m):
+	out = [[int(x) for x in row] for row in m.tolist()]
+	assert all(x == y for (r, s) in zip(out, m.tolist()) for (x, y) in zip(r, s))
+	return out
+
+def _float_matrix(m):
+	return np.array([[float(x) for x in row] for row in m.tolist()])
+
+def _layer_sites(layer, hnf, cell, supercell, chunk_size):
+	'''
+	Sites of the lattice with integer rows modulo the rows of ``cell``
+	 (2x2 ints), whose HNF is ``hnf``.  ``supercell`` is the cartesian
+	 supercell as a float array.
+	'''
+	(((h00, _), (_, h11)), ((m00, m01), (m10, m11))) = (hnf, cell)
+	det = m00 * m11 - m01 * m10
+	volume = abs(det)
+	assert volume == h00 * h11
+	# (larger volumes use python ints, which is slow, but then again
+	#  so is anything else that involves billions of sites)
+	dtype = np.int64 if volume < _INT64_MAX_VOLUME else object
+
+	for start in range(0, volume, chunk_size):
+		k = np.arange(start, min(start + chunk_size, volume), dtype=dtype)
+		(i, j) = (k % h00, k // h00)
+
+		# frac = (i, j) M^-1 = (i, j) adj(M) / det(M), reduced modulo 1.
+		# (factors are reduced mod |det| first, so no product exceeds volume**2)
+		n0 = (i * (m11 % volume) - j * (m10 % volume)) % volume
+		n1 = (j * (m00 % volume) - i * (m01 % volume)) % volume
+		if det < 0:
+			(n0, n1) = (-n0 % volume, -n1 % volume)
+		frac = (np.column_stack([n0, n1]) / volume).astype(float)
+		yield SiteChunk(layer, np.column_stack([i, j]).astype(np.int64), frac, frac.dot(supercell))
+
+@public
+def supercell_sites(pattern, layers=(1, 2), chunk_size=DEFAULT_CHUNK_SIZE):
+	'''
+	Generate the sites of both layers of a numeric MoirePattern within its
+	 commensurate cell, as SiteChunks of at most ``chunk_size`` sites.
+	 Layer 1 comes first.
+	'''
+	c = _int_matrix(pattern.c_matrix())
+	supercell = _float_matrix(pattern.commensurate_cell())
+	if 1 in layers:
+		yield from _layer_sites(1, c, c, supercell, chunk_size)
+	if 2 in layers:
+		d = _int_matrix(pattern.d_matrix())
+		d_hnf = _int_matrix(pattern.d_matrix_hnf())
+		yield from _layer_sites(2, d_hnf, d, supercell, chunk_size)
+
+def _site_counts(pattern):
+	c = pattern.c_matrix_hnf()
+	d = pattern.d_matrix_hnf()
+	return (int(c[0,0] * c[1,1]), int(d[0,0] * d[1,1]))
+
+@public
+def write_poscar(pattern, file, species=('C', 'C'), lattice_constant=1.0,
+		separation=1.0, vacuum=10.0, comment='moire supercell', chunk_size=DEFAULT_CHUNK_SIZE):
+	'''
+	Write the commensurate supercell of a numeric MoirePattern as a VASP POSCAR,
+	 streaming the sites chunk by chunk.
+
+	All lengths are in units of ``lattice_constant`` times those of the cells.
+	 Layer 2 sits ``separation`` above layer 1, and the third lattice vector
+	 is ``separation + vacuum`` long.  ``species`` names the element of each
+	 layer;  if both are the same, they are written as a single species.
+	'''
+	supercell = _float_matrix(pattern.commensurate_cell()) * lattice_constant
+	height = separation + vacuum
+	counts = _site_counts(pattern)
+	(names, counts) = ((species[0],), (sum(counts),)) if species[0] == species[1] else (species, counts)
+
+	file.write(comment.replace('\n', ' ') + '\n')
+	file.write('1.0\n')
+	for (x, y) in supercell:
+		file.write('  {:.16f} {:.16f} {:.16f}\n'.format(x, y, 0.0))
+	file.write('  {:.16f} {:.16f} {:.16f}\n'.format(0.0, 0.0, height))
+	file.write(' '.join(names) + '\n')
+	file.write(' '.join(str(n) for n in counts) + '\n')
+	file.write('Direct\n')
+	for chunk in supercell_sites(pattern, chunk_size=chunk_size):
+		z = 0.0 if chunk.layer == 1 else separation / height
+		np.savetxt(file, np.column_stack([chunk.frac, np.full(len(chunk.frac), z)]), fmt='%.16f')
+
+@public
+def write_xyz(pattern, file, species=('C', 'C'), lattice_constant=1.0,
+		separation=1.0, comment='moire supercell', chunk_size=DEFAULT_CHUNK_SIZE):
+	'''
+	Write the sites of a numeric MoirePattern's commensurate cell as XYZ,
+	 streaming the sites chunk by chunk.  (see write_poscar for the arguments)
+	'''
+	file.write('{}\n'.format(sum(_site_counts(pattern))))
+	file.write(comment.replace('\n', ' ') + '\n')
+	for chunk in supercell_sites(pattern, chunk_size=chunk_size):
+		z = 0.0 if chunk.layer == 1 else separation
+		xyz = np.column_stack([chunk.cart * lattice_constant, np.full(len(chunk.cart), z)])
+		np.savetxt(file, xyz, fmt=species[chunk.layer - 1] + ' %.10f %.10f %.10f')
@@ -0,0 +1,152 @@
+from collections import namedtuple
+import concurrent.futures
+import itertools
+import os
+import signal
+
+from . import instrument
+from moire.util import public
+
+__doc__ = '''
+Parallel evaluation of many MoirePattern constructions.
+
+Each parameter set is a dict of keyword arguments for one of the
+ constructors in build.py.  The optional key 'visit_family' holds a
+ tuple of arguments for MoirePattern.visit_family, which is applied to
+ the constructed pattern.  e.g.
+
+	sweep('prim_rotation_moire_pq', [
+		dict(β=3, p=p, q=q, visit_family=(HEX_INDEX,))
+		for (p, q) in pairs
+	])
+'''
+
+@public
+class SweepTimeout(BaseException):
+	'''
+	Stored in SweepResult.error when a task exceeds its time limit.
+
+	(a BaseException, so that it can't be swallowed by an ``except Exception``
+	 somewhere inside the sympy code that it interrupts)
+	'''
+	pass
+
+@public
+class SweepResult(namedtuple('SweepResult', 'index params value error')):
+	'''
+	The outcome of one parameter set.  index is its position in the input.
+	Exactly one of value (the MoirePattern) and error (the exception) is None.
+	'''
+	__slots__ = ()
+
+def _resolve(constructor):
+	if isinstance(constructor, str):
+		from . import build
+		return getattr(build, constructor)
+	return constructor
+
+def _raise_timeout(signum, frame):
+	raise SweepTimeout()
+
+def _run_one(constructor, params, timeout):
+	kw = dict(params)
+	family = kw.pop('visit_family', None)
+
+	if timeout is not None:
+		signal.signal(signal.SIGALRM, _raise_timeout)
+		signal.setitimer(signal.ITIMER_REAL, timeout)
+	try:
+		value = constructor(**kw)
+		if family is not None:
+			value = value.visit_family(*family)
+		# C is computed lazily; make sure that happens here, under the time
+		#  limit and the profiler, rather than later in the parent process.
+		#  (this is None for a pattern whose E still has free symbols)
+		value._c
+		return (value, None)
+	except (Exception, SweepTimeout) as e:
+		return (None, e)
+	finally:
+		if timeout is not None:
+			signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _run_chunk(constructor, chunk, timeout, profile):
+	'''
+	Worker entry point.  Returns the results, and the profiling counters
+	 accumulated by this chunk (or None).
+	'''
+	constructor = _resolve(constructor)
+	if not profile:
+		return ([SweepResult(i, p, *_run_one(constructor, p, timeout)) for (i, p) in chunk], None)
+	with instrument.profiling():
+		results = [SweepResult(i, p, *_run_one(constructor, p, timeout)) for (i, p) in chunk]
+		return (results, instrument.stats())
+
+def _chunks(iterable, size):
+	it = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(it, size))
+		if not chunk:
+			return
+		yield chunk
+
+@public
+def sweep(constructor, param_sets, *, workers=None, chunksize=1, timeout=None, ordered=True, profile=False):
+	'''
+	Construct a MoirePattern for every parameter set on a process pool.
+
+	constructor:  a function from build.py, or its name.
+	param_sets:   iterable of kwarg dicts (consumed lazily).
+	chunksize:    number of parameter sets sent to a worker at a time.
+	timeout:      per-task limit in seconds.  A task that runs over is
+	              interrupted inside its worker and reported with a
+	              SweepTimeout error, so the rest of the batch carries on.
+	              (requires SIGALRM, i.e. a unix)
+	ordered:      yield results in input order if True,
+	              otherwise as they complete.
+	profile:      collect moire.exact.instrument counters in the workers,
+	              and merge them into this process's counters.
+
+	Yields SweepResult.  Each pattern's C is computed in the worker, so
+	 problems with it (e.g. an irrational E) show up in SweepResult.error,
+	 as do exceptions raised by the constructor, rather than being raised.
+	'''
+	if timeout is not None and not hasattr(signal, 'setitimer'):
+		raise ValueError('sweep: timeout is not supported on this platform')
+	if chunksize < 1:
+		raise ValueError('sweep: chunksize must be positive')
+
+	workers = workers or os.cpu_count() or 1
+	chunks = _chunks(enumerate(param_sets), chunksize)
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+		# bound the number of chunks in flight so that param_sets
+		#  can be a long (or infinite) generator
+		max_pending = 4 * workers
+		pending = set()
+		buffered = {}
+		next_index = 0
+		exhausted = False
+		while pending or not exhausted:
+			while not exhausted and len(pending) < max_pending:
+				chunk = next(chunks, None)
+				if chunk is None:
+					exhausted = True
+				else:
+					pending.add(pool.submit(_run_chunk, constructor, chunk, timeout, profile))
+			if not pending:
+				break
+
+			(done, pending) = concurrent.futures.wait(
+				pending, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				(results, stats) = future.result()
+				if stats is not None:
+					instrument.merge_stats(stats)
+				for result in results:
+					if not ordered:
+						yield result
+					else:
+						buffered[result.index] = result
+			while next_index in buffered:
+				yield buffered.pop(next_index)
+				next_index += 1
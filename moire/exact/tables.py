@@ -0,0 +1,213 @@
+from bisect import bisect_left, bisect_right
+import functools
+from math import atan2, sqrt
+import os
+import shutil
+import tempfile
+
+from .enumerate import RotationMoire, enumerate_rotation_moires
+from moire.util import public
+
+__doc__ = '''
+Angle-sorted tables of commensurate rotations, for interactive lookups.
+
+Building a table costs one pass of enumerate_rotation_moires;  afterwards,
+ finding the commensurate rotation nearest to an angle is a bisection.
+
+For large tables shared between processes, save_rotation_table writes
+ them to disk once (also available as  python -m moire.exact.tables),
+ and MappedAngleTable answers the same queries from memory-mapped files.
+'''
+
+@public
+class AngleTable:
+	'''
+	The commensurate rotations of prim_rotation_cell(β) up to some supercell
+	 volume, sorted by angle.  Entries are RotationMoire.
+	'''
+	def __init__(self, β, records):
+		self.β = β
+		self.records = sorted(records, key=lambda r: r.angle)
+		self.angles = [r.angle for r in self.records]
+
+	@classmethod
+	def build(klass, β, max_volume):
+		return klass(β, enumerate_rotation_moires(β, max_volume=max_volume))
+
+	def __len__(self):
+		return len(self.records)
+
+	def range(self, lo, hi):
+		''' All entries with  lo <= angle <= hi  (radians), by increasing angle. '''
+		return self.records[bisect_left(self.angles, lo):bisect_right(self.angles, hi)]
+
+	def nearest(self, angle, tolerance=None):
+		'''
+		The entry whose angle is closest to ``angle`` (radians).  Returns None
+		 if the table is empty, or if no entry lies within ``tolerance``.
+		'''
+		k = bisect_left(self.angles, angle)
+		candidates = self.records[max(k - 1, 0):k + 1]
+		if not candidates:
+			return None
+		best = min(candidates, key=lambda r: abs(r.angle - angle))
+		if tolerance is not None and abs(best.angle - angle) > tolerance:
+			return None
+		return best
+
+@public
+@functools.lru_cache(maxsize=16)
+def angle_table(β, max_volume):
+	''' A shared AngleTable, built on first use. '''
+	return AngleTable.build(β, max_volume)
+
+# On-disk tables.
+#
+# A table is a directory holding one .npy file per column, all sorted by
+#  angle.  Columns are opened with np.load(mmap_mode='r'), so any number of
+#  processes can share a table without copying or recomputing it, and a
+#  query only touches the pages that it needs.
+
+TABLE_COLUMNS = ('a', 'b', 'c', 'k', 'angle', 'volume', 'c00', 'c10', 'c11')
+
+def table_name(β, max_volume):
+	return 'rotations-β{}-v{}'.format(β, max_volume)
+
+def default_table_directory():
+	from .cache import cache_directory
+	return os.path.join(cache_directory() or os.path.expanduser('~/.cache/moire'), 'tables')
+
+@public
+def build_rotation_table(β, max_volume):
+	'''
+	Columns of a table of all commensurate rotations of prim_rotation_cell(β)
+	 with supercell volume <= max_volume, sorted by angle.  (see TABLE_COLUMNS)
+	Returns a dict of NumPy arrays.
+	'''
+	import numpy as np
+	from .batch import rotation_supercells
+	from .enumerate import primitive_rotation_triples
+
+	(a, b, c) = np.array(list(primitive_rotation_triples(β, max_volume)), dtype=np.int64).reshape(-1, 3).T
+	batch = rotation_supercells(β, a, b, c)
+	keep = np.flatnonzero(batch.volume <= max_volume)
+	# (math.atan2 rather than np.arctan2, to agree exactly with enumerate_rotation_moires)
+	angle = np.array([atan2(y * sqrt(β), x) for (x, y) in zip(a[keep].tolist(), b[keep].tolist())])
+	order = np.argsort(angle, kind='stable')
+	(angle, order) = (angle[order], keep[order])
+	columns = {
+		'a': a[order], 'b': b[order], 'c': c[order],
+		'k': np.ones(len(order), dtype=np.int64),
+		'angle': angle,
+		'volume': batch.volume[order],
+		'c00': batch.c_matrix[order, 0, 0],
+		'c10': batch.c_matrix[order, 1, 0],
+		'c11': batch.c_matrix[order, 1, 1],
+	}
+	return {name: np.ascontiguousarray(x, dtype=np.float64 if name == 'angle' else np.int64)
+		for (name, x) in columns.items()}
+
+@public
+def save_rotation_table(β, max_volume, directory=None):
+	'''
+	Build a table and write it under ``directory`` (default: a 'tables'
+	 subdirectory of the cache directory).  Returns its path.  The table
+	 appears atomically, so concurrent builders do not see partial tables.
+	'''
+	import numpy as np
+	directory = directory or default_table_directory()
+	path = os.path.join(directory, table_name(β, max_volume))
+	if os.path.isdir(path):
+		return path
+	os.makedirs(directory, exist_ok=True)
+	columns = build_rotation_table(β, max_volume)
+	tmp = tempfile.mkdtemp(dir=directory, prefix='.tmp-')
+	try:
+		os.chmod(tmp, 0o755) # (mkdtemp makes it private)
+		for (name, x) in columns.items():
+			np.save(os.path.join(tmp, name + '.npy'), x)
+		try:
+			os.rename(tmp, path)
+		except OSError:
+			if not os.path.isdir(path): # (otherwise, somebody else won the race)
+				raise
+	finally:
+		shutil.rmtree(tmp, ignore_errors=True)
+	return path
+
+@public
+class MappedAngleTable:
+	'''
+	A table written by save_rotation_table, memory-mapped.  Supports the same
+	 queries as AngleTable, by binary search on the angle column.
+	'''
+	def __init__(self, path, β):
+		import numpy as np
+		self.β = β
+		self.path = path
+		self.columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+			for name in TABLE_COLUMNS}
+		self.angles = self.columns['angle']
+
+	@classmethod
+	def open(klass, β, max_volume, directory=None, build=True):
+		'''
+		Open the table for (β, max_volume) in ``directory``,
+		 building it first if it does not exist and ``build`` is true.
+		'''
+		path = os.path.join(directory or default_table_directory(), table_name(β, max_volume))
+		if not os.path.isdir(path):
+			if not build:
+				raise FileNotFoundError(path)
+			path = save_rotation_table(β, max_volume, directory)
+		return klass(path, β)
+
+	def __len__(self):
+		return len(self.angles)
+
+	def record(self, index):
+		''' Row ``index`` as a RotationMoire. '''
+		(a, b, c, angle, c00, c10, c11, volume) = (self.columns[name][index]
+			for name in ('a', 'b', 'c', 'angle', 'c00', 'c10', 'c11', 'volume'))
+		cmat = ((int(c00), 0), (int(c10), int(c11)))
+		return RotationMoire(self.β, int(a), int(b), int(c), float(angle), cmat, int(volume))
+
+	def index_range(self, lo, hi):
+		''' The slice of rows with  lo <= angle <= hi  (radians). '''
+		return slice(
+			int(self.angles.searchsorted(lo, side='left')),
+			int(self.angles.searchsorted(hi, side='right')),
+		)
+
+	def range(self, lo, hi):
+		''' All entries with  lo <= angle <= hi  (radians), by increasing angle. '''
+		return [self.record(i) for i in range(len(self))[self.index_range(lo, hi)]]
+
+	def nearest(self, angle, tolerance=None):
+		'''
+		The entry whose angle is closest to ``angle`` (radians).  Returns None
+		 if the table is empty, or if no entry lies within ``tolerance``.
+		'''
+		k = int(self.angles.searchsorted(angle))
+		candidates = [i for i in (k - 1, k) if 0 <= i < len(self)]
+		if not candidates:
+			return None
+		best = min(candidates, key=lambda i: abs(self.angles[i] - angle))
+		if tolerance is not None and abs(self.angles[best] - angle) > tolerance:
+			return None
+		return self.record(best)
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(prog='python -m moire.exact.tables',
+		description='Build memory-mappable tables of commensurate rotations.')
+	parser.add_argument('--beta', type=int, nargs='+', required=True, help='squarefree β (one or more)')
+	parser.add_argument('--max-volume', type=int, required=True)
+	parser.add_argument('--directory', help='(default: {})'.format(default_table_directory()))
+	args = parser.parse_args()
+	for β in args.beta:
+		path = save_rotation_table(β, args.max_volume, args.directory)
+		print('{}: {} rows'.format(path, len(MappedAngleTable(path, β))))
+
+if __name__ == '__main__':
+	main()
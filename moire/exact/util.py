@@ -1,15 +1,14 @@
 
-import sympy
-from sympy import sympify
-
 from moire.util import public
 
 @public
 def undummy(expr):
 	''' a terrible hack to coerce dummy variables into namable ones '''
+	from sympy import sympify
 	return sympify(str(expr))
 
 @public
 def is_squarefree(x):
+	import sympy
 	return x == sympy.ntheory.factor_.core(x)
 
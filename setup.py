@@ -15,7 +15,7 @@ setup(
 	author = 'Michael Lamparski',
 	author_email = 'lampam@rpi.edu',
 
-	packages=find_packages(),
+	packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
 	install_requires=[
 		'numpy',
 		'sympy',